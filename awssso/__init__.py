@@ -1,7 +1,16 @@
-from pkg_resources import get_distribution, DistributionNotFound
+def __getattr__(name):
+    # Resolving the distribution version is slow, only do it when asked for.
+    if name == '__version__':
+        try:
+            from importlib.metadata import version, PackageNotFoundError
+        except ImportError:
+            from pkg_resources import get_distribution, DistributionNotFound as PackageNotFoundError
 
-try:
-    __version__ = get_distribution(__name__).version
-except DistributionNotFound:
-    # package is not installed
-    pass
+            def version(name):
+                return get_distribution(name).version
+        try:
+            return version(__name__)
+        except PackageNotFoundError:
+            # package is not installed
+            pass
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
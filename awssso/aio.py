@@ -0,0 +1,255 @@
+"""asyncio API for library users (pip install awssso[async]).
+
+One aiohttp session (connection pool) can be shared by any number of
+clients, so a single process serves many concurrent credential requests:
+
+    async with new_session() as session:
+        sso = AsyncSSOClient(token, 'eu-west-1', session=session)
+        credentials = await sso.get_credentials(instance_id, profile_id)
+"""
+import asyncio
+import json
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+import aiohttp
+
+from awssso.helpers import CredentialsHelper
+from awssso.saml import AssumeRoleValidationError, BotoClientError, SAMLHelper
+from awssso.transport import DEFAULTS, Transport, backoff_delay
+
+
+class Error(Exception):
+    """Base class for awssso.aio exceptions."""
+
+    def __init__(self, msg=''):
+        self.message = msg
+        Exception.__init__(self, msg)
+
+    def __repr__(self):
+        return self.message
+
+    __str__ = __repr__
+
+
+class PortalError(Error):
+    """Raised when the portal answers with an error status."""
+
+    def __init__(self, url, status, body):
+        Error.__init__(self, f'{url} returned HTTP {status}')
+        self.status = status
+        self.body = body
+
+
+STS_NS = {
+    'sts': 'https://sts.amazonaws.com/doc/2011-06-15/'
+}
+
+
+def new_session(pool_size=100, connect_timeout=DEFAULTS['connect_timeout'], read_timeout=DEFAULTS['read_timeout']):
+    """Return an aiohttp session keeping up to `pool_size` connections alive."""
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=pool_size),
+        timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+    )
+
+
+async def _request(session, method, url, max_retries=DEFAULTS['max_retries'], **kwargs):
+    """Send a request, retrying throttled and failed calls like Transport.get; return (status, body)."""
+    for attempt in range(max_retries + 1):
+        try:
+            async with session.request(method, url, **kwargs) as r:
+                body = await r.read()
+                if r.status not in Transport.RETRY_STATUSES or attempt == max_retries:
+                    return r.status, body
+                retry_after = r.headers.get('Retry-After')
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if attempt == max_retries:
+                raise
+            retry_after = None
+        await asyncio.sleep(backoff_delay(attempt, retry_after))
+
+
+def _sts_error(status, body):
+    try:
+        root = ET.fromstring(body)
+    except ET.ParseError:
+        # Not an STS error document: a proxy or load balancer page, or no body
+        return {
+            'Error': {'Code': str(status), 'Message': f'STS returned HTTP {status}'},
+            'ResponseMetadata': {'RequestId': ''}
+        }
+    return {
+        'Error': {
+            'Code': root.findtext('.//sts:Error/sts:Code', '', STS_NS),
+            'Message': root.findtext('.//sts:Error/sts:Message', '', STS_NS)
+        },
+        'ResponseMetadata': {
+            'RequestId': root.findtext('.//sts:RequestId', '', STS_NS)
+        }
+    }
+
+
+async def assume_role_with_saml(session, saml, duration=None, region=None, max_retries=DEFAULTS['max_retries'], endpoint_url=None, role_arn=None):
+    """AssumeRoleWithSAML through the STS query API, returning the same dict as boto3.
+
+    The call is not signed: like with boto3, the SAML assertion is all STS needs.
+    `role_arn` picks one of the roles of the assertion, the first by default.
+    """
+    url = endpoint_url or (f'https://sts.{region}.amazonaws.com/' if region else 'https://sts.amazonaws.com/')
+    role_arn, principal_arn = saml.role(role_arn)
+    data = {
+        'Action': 'AssumeRoleWithSAML',
+        'Version': '2011-06-15',
+        'RoleArn': role_arn,
+        'PrincipalArn': principal_arn,
+        'SAMLAssertion': saml.payload,
+        'DurationSeconds': str(duration or saml.duration)
+    }
+    status, body = await _request(session, 'POST', url, max_retries, data=data)
+    if status != 200:
+        response = _sts_error(status, body)
+        if response['Error']['Code'] == 'ValidationError':
+            raise AssumeRoleValidationError(response)
+        raise BotoClientError(response)
+
+    result = ET.fromstring(body).find('.//sts:AssumeRoleWithSAMLResult/sts:Credentials', STS_NS)
+    credentials = {_: result.findtext(f'sts:{_}', None, STS_NS) for _ in ('AccessKeyId', 'SecretAccessKey', 'SessionToken')}
+    credentials['Expiration'] = datetime.fromisoformat(result.findtext('sts:Expiration', None, STS_NS).replace('Z', '+00:00'))
+    return {'Credentials': credentials}
+
+
+class AsyncSSOClient():
+    """asyncio counterpart of SSOClient.
+
+    Without `session`, the client opens its own from within the event loop,
+    on first use, and closes it in `close`; a shared session is left open.
+    Catalogue file I/O runs in the default executor, off the event loop.
+    `portal_endpoint` and `sts_endpoint` override the AWS urls, like the
+    settings of the same name.
+    """
+
+    def __init__(self, token, region='eu-west-1', catalogue=None, session=None, max_retries=DEFAULTS['max_retries'],
+                 portal_endpoint=None, sts_endpoint=None):
+        self._token = token
+        self._region = region
+        self._catalogue = catalogue
+        self._max_retries = max_retries
+        self._portal_endpoint = portal_endpoint.rstrip('/') if portal_endpoint else None
+        self._sts_endpoint = sts_endpoint
+        self._owns_session = session is None
+        self._session = session
+        self._headers = {
+            'x-amz-sso_bearer_token': self._token
+        }
+
+    async def __aenter__(self):
+        self._client_session()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    @property
+    def session(self):
+        return self._session
+
+    async def close(self):
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _client_session(self):
+        # aiohttp sessions must be created while the event loop runs
+        if self._session is None:
+            self._session = new_session()
+        return self._session
+
+    def _portal_url(self):
+        return self._portal_endpoint or f'https://portal.sso.{self._region}.amazonaws.com'
+
+    async def _catalogue_call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def _get(self, url, **kwargs):
+        return await _request(self._client_session(), 'GET', url, self._max_retries, headers=self._headers, **kwargs)
+
+    async def _get_json(self, url, **kwargs):
+        status, body = await self._get(url, **kwargs)
+        if status != 200:
+            raise PortalError(url, status, body)
+        return json.loads(body)
+
+    async def _paginate(self, url):
+        params = {}
+        results = []
+        while True:
+            payload = await self._get_json(url, params=params)
+            results.extend(payload['result'])
+            if not payload.get('paginationToken'):
+                return results
+            params = {'paginationToken': payload['paginationToken']}
+
+    async def whoami(self):
+        return await self._get_json(f'{self._portal_url()}/token/whoAmI')
+
+    async def get_instances(self, refresh=False):
+        if self._catalogue and not refresh:
+            instances = await self._catalogue_call(self._catalogue.instances)
+            if instances is not None:
+                return instances
+
+        url = f'{self._portal_url()}/instance/appinstances'
+        instances = [i for i in await self._paginate(url) if i['applicationName'] == 'AWS Account']
+        if self._catalogue:
+            await self._catalogue_call(self._catalogue.set_instances, instances)
+        return instances
+
+    async def get_profiles(self, instance_id, refresh=False):
+        if self._catalogue and not refresh:
+            profiles = await self._catalogue_call(self._catalogue.profiles, instance_id)
+            if profiles is not None:
+                return profiles
+
+        url = f'{self._portal_url()}/instance/appinstance/{instance_id}/profiles'
+        profiles = await self._paginate(url)
+        if self._catalogue:
+            await self._catalogue_call(self._catalogue.set_profiles, instance_id, profiles)
+        return profiles
+
+    async def get_saml_payload(self, instance_id, profile_id):
+        if self._catalogue:
+            url = await self._catalogue_call(self._catalogue.profile_url, instance_id, profile_id)
+            if url:
+                try:
+                    return (await self._get_json(url))['encodedResponse']
+                except PortalError:
+                    await self._catalogue_call(self._catalogue.invalidate, instance_id)
+
+        profiles = await self.get_profiles(instance_id, refresh=bool(self._catalogue))
+        url = next((_['url'] for _ in profiles if _['id'] == profile_id), None)
+        if url is None:
+            raise Error(f'profile {profile_id} not found in instance {instance_id}')
+        return (await self._get_json(url))['encodedResponse']
+
+    async def get_credentials(self, instance_id, profile_id, duration=None, sts_region=None, role_arn=None):
+        """Return a CredentialsHelper for a profile, assuming its role with the SAML assertion."""
+        saml = SAMLHelper(await self.get_saml_payload(instance_id, profile_id))
+        response = await assume_role_with_saml(
+            self._client_session(), saml, duration, sts_region, self._max_retries, self._sts_endpoint, role_arn
+        )
+        return CredentialsHelper(response['Credentials'])
+
+    async def get_roles_credentials(self, instance_id, profile_id, role_arns=None, duration=None, sts_region=None):
+        """Assume several roles (all by default) from one SAML assertion concurrently.
+
+        Returns a dict of role arn to CredentialsHelper, or to the exception raised for that role.
+        """
+        saml = SAMLHelper(await self.get_saml_payload(instance_id, profile_id))
+        role_arns = role_arns or saml.role_arns
+        responses = await asyncio.gather(*[
+            assume_role_with_saml(self._client_session(), saml, duration, sts_region, self._max_retries, self._sts_endpoint, _) for _ in role_arns
+        ], return_exceptions=True)
+        return {
+            arn: r if isinstance(r, Exception) else CredentialsHelper(r['Credentials']) for arn, r in zip(role_arns, responses)
+        }
@@ -0,0 +1,181 @@
+import threading
+from time import sleep, time
+
+from awssso.catalogue import Catalogue
+from awssso.config import Configuration
+from awssso.helpers import (TOKEN_LOCK_STALE, TOKEN_LOCK_TIMEOUT,
+                            SecretsManager, credentials_cache_key,
+                            get_or_assume_credentials, refresh_due,
+                            refresh_window, single_flight, spawn_refresh,
+                            token_lock_name)
+from awssso.ssoclient import SSOClient
+from awssso.transport import get_transport, transport_settings
+
+
+class Error(Exception):
+    """Base class for CredentialsBroker exceptions."""
+
+    def __init__(self, msg=''):
+        self.message = msg
+        Exception.__init__(self, msg)
+
+    def __repr__(self):
+        return self.message
+
+    __str__ = __repr__
+
+
+class ProfileNotFound(Error):
+    """Raised when the requested profile is not configured."""
+    pass
+
+
+class TokenExpired(Error):
+    """Raised when credentials can not be renewed without an interactive login."""
+    pass
+
+
+class CredentialsBroker():
+    """Resolves credentials for awssso profiles and keeps them in memory.
+
+    Secrets managers and credentials are reused across calls, so that a warm
+    broker answers without touching the keyring until credentials expire.
+    With a DriverPool, expired authn tokens are refreshed from a warm browser
+    as long as no MFA code is needed.
+    """
+
+    def __init__(self, pool=None):
+        self._pool = pool
+        self._secrets = {}
+        self._catalogues = {}
+        self._credentials = {}
+        self._profiles = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def secrets(self, params):
+        key = (params.get('username'), params.get('url'))
+        with self._lock:
+            if key not in self._secrets:
+                self._secrets[key] = SecretsManager.from_params(params, Configuration().configdir)
+            return self._secrets[key]
+
+    def catalogue(self, params):
+        key = (params.get('username'), params.get('url'))
+        with self._lock:
+            if key not in self._catalogues:
+                self._catalogues[key] = Catalogue.from_params(Configuration().configdir, params)
+            return self._catalogues[key]
+
+    def transport(self, params):
+        return get_transport(**transport_settings(params))
+
+    def params(self, profile):
+        cfg = Configuration()
+        if profile not in cfg.config:
+            raise ProfileNotFound(f'profile {profile} does not exist')
+        return cfg.config[profile]
+
+    def token(self, params, force_refresh=False):
+        secrets = self.secrets(params)
+        with self._key_lock((params.get('username'), params.get('url'))):
+            secrets.reload()
+            token = secrets.get('authn-token')
+            expiry_date = int(secrets.get('authn-expiry-date', '0'))
+            if (force_refresh) or (not token) or (time() > expiry_date):
+                token = self.refresh_token(params)
+            return token
+
+    def refresh_token(self, params):
+        if self._pool is None:
+            raise TokenExpired(f'authn token for {params.get("username")} has expired')
+
+        from awssso.ssodriver import AlertMessage, MFACodeNeeded, SSODriver
+
+        secrets = self.secrets(params)
+        password = secrets.get('credentials')
+        if not password:
+            raise TokenExpired(f'no password stored for {params.get("username")}')
+
+        config_dir = Configuration().configdir
+        token = secrets.get('authn-token')
+        with single_flight(config_dir, token_lock_name(params['url'], params['username']), TOKEN_LOCK_TIMEOUT, TOKEN_LOCK_STALE):
+            # An "awssso login" may have signed in while we waited
+            secrets.reload()
+            latest = secrets.get('authn-token')
+            if latest and latest != token and time() < int(secrets.get('authn-expiry-date', '0')):
+                return latest
+
+            driver = SSODriver(params['url'], params['username'], cookie_dir=config_dir, pool=self._pool)
+            try:
+                token, expiry_date = driver.refresh_token(params['username'], password)
+            except MFACodeNeeded:
+                raise TokenExpired(f'MFA code needed to sign in {params.get("username")}')
+            except AlertMessage as e:
+                raise Error(str(e))
+            finally:
+                driver.close()
+
+            with secrets.batch():
+                secrets.set('authn-token', token)
+                secrets.set('authn-expiry-date', str(expiry_date))
+        return token
+
+    def get(self, profile, duration=None, renew=False):
+        params = self.params(profile)
+        # Profiles of other portal users may share the instance and profile ids
+        key = self.secrets(params)._cache_key(credentials_cache_key(params['instance_id'], params['profile_id']))
+
+        self._profiles[profile] = key
+        with self._key_lock(key):
+            credentials = self._credentials.get(key)
+            if credentials and not credentials.expired and not renew:
+                return credentials
+
+            self.secrets(params).reload()
+            credentials = get_or_assume_credentials(
+                self.secrets(params), lambda: SSOClient(self.token(params), params['region'], self.catalogue(params), self.transport(params)),
+                params['instance_id'], params['profile_id'], duration, renew, Configuration().configdir,
+                transport=self.transport(params)
+            )
+            self._credentials[key] = credentials
+            return credentials
+
+    def _refresh_ahead(self, profile, window, spawned):
+        params = self.params(profile)
+        key = self._profiles[profile]
+
+        # An authn token about to expire needs a browser login, which is left
+        # to a detached "awssso login" process without a browser pool.
+        expiry_date = int(self.secrets(params).get('authn-expiry-date', '0'))
+        if refresh_due(expiry_date, window) and time() - spawned.get(profile, 0) > window:
+            spawned[profile] = time()
+            if self._pool is None:
+                spawn_refresh(profile, params['region'], force_refresh=True)
+                return
+            self.token(params, force_refresh=True)
+
+        credentials = self._credentials.get(key)
+        if credentials and refresh_due(credentials.expires, refresh_window(window, credentials.lifetime)):
+            # Another process may have renewed them already
+            with self._key_lock(key):
+                self._credentials.pop(key, None)
+            credentials = self.get(profile)
+            if refresh_due(credentials.expires, refresh_window(window, credentials.lifetime)):
+                self.get(profile, renew=True)
+
+    def refresh_ahead(self, window, interval=30):
+        """Renew credentials served by the broker when they expire within `window` seconds."""
+        spawned = {}
+        while True:
+            sleep(interval)
+            for profile in list(self._profiles):
+                try:
+                    self._refresh_ahead(profile, window, spawned)
+                except Exception:
+                    # Credentials will be renewed by the next request instead
+                    pass
@@ -0,0 +1,59 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import perf_counter
+
+from awssso.saml import BotoClientError
+from awssso.timings import span, tracer
+
+DEFAULT_WORKERS = 8
+
+
+class Result():
+    def __init__(self, profile, value=None, error=None, elapsed=0.0):
+        self.profile = profile
+        self.value = value
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def _run(profile, job, parent=None):
+    start = perf_counter()
+    try:
+        with span('job', parent, label=profile):
+            return Result(profile, value=job(), elapsed=perf_counter() - start)
+    except BotoClientError as e:
+        error = f'{e} (request id: {e.request_id})'
+    except SystemExit as e:
+        error = str(e)
+    except Exception as e:
+        error = str(e) or type(e).__name__
+    return Result(profile, error=error, elapsed=perf_counter() - start)
+
+
+def run(jobs, workers=DEFAULT_WORKERS):
+    """Run `jobs` (a mapping of profile name to callable) on a bounded thread pool.
+
+    Results are yielded as they complete, failures are reported in the result
+    instead of being raised.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        # Spans of the worker threads nest in the span of the caller
+        parent = tracer.current()
+        futures = [executor.submit(_run, profile, job, parent) for profile, job in jobs.items()]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def report(results, file):
+    width = max([len(_.profile) for _ in results] + [7])
+    for result in sorted(results, key=lambda _: _.profile):
+        status = 'ok' if result.ok else 'FAILED'
+        line = f'{result.profile:{width}}  {status:6}  {result.elapsed:6.2f}s'
+        if not result.ok:
+            line += f'  {result.error}'
+        print(line, file=file)
+    failed = len([_ for _ in results if not _.ok])
+    print(f'{len(results) - failed} succeeded, {failed} failed', file=file)
@@ -0,0 +1,240 @@
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+from pathlib import Path
+from time import time
+
+from awssso.filelock import FileLock, atomic_write
+
+
+class Error(Exception):
+    """Base class for credentials cache exceptions."""
+
+    def __init__(self, msg=''):
+        self.message = msg
+        Exception.__init__(self, msg)
+
+    def __repr__(self):
+        return self.message
+
+    __str__ = __repr__
+
+
+def evict(entries, now=None):
+    """Drop entries of `entries` that have expired, in place."""
+    now = now or time()
+    for key in [k for k, v in entries.items() if v['expires'] <= now]:
+        del entries[key]
+    return entries
+
+
+def fresh(entry):
+    return entry['value'] if entry and entry['expires'] > time() else None
+
+
+class MemoryCache():
+    """Credentials cache living as long as the process, shared by all its threads."""
+
+    _entries = {}
+    _lock = threading.Lock()
+
+    def __init__(self, cache_dir=None):
+        pass
+
+    def get(self, key):
+        with MemoryCache._lock:
+            return fresh(MemoryCache._entries.get(key))
+
+    def set(self, key, value, expires):
+        self.set_many([(key, value, expires)])
+
+    def set_many(self, items):
+        with MemoryCache._lock:
+            MemoryCache._entries.update({k: {'expires': e, 'value': v} for k, v, e in items})
+            evict(MemoryCache._entries)
+
+
+class EncryptedFileCache():
+    """Credentials cache in a local file encrypted with Fernet (cryptography package).
+
+    The key is read from AWSSSO_CACHE_KEY, or generated once into a key file
+    next to the cache.
+    """
+
+    def __init__(self, cache_dir):
+        try:
+            from cryptography.fernet import Fernet, InvalidToken
+        except ImportError:
+            raise Error('the file credentials cache needs the cryptography package (pip install awssso[cache])')
+
+        self._dir = Path(cache_dir) / 'cache'
+        self._file = self._dir / 'credentials.enc'
+        self._invalid_token = InvalidToken
+        self._fernet = Fernet(self._key())
+        self._lock = threading.Lock()
+        self._entries = None
+        self._mtime = None
+
+    def _key(self):
+        key = os.environ.get('AWSSSO_CACHE_KEY')
+        if key:
+            return key.encode()
+
+        from cryptography.fernet import Fernet
+
+        self._dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+        key_file = self._dir / 'cache.key'
+        with FileLock(f'{key_file}.lock'):
+            if not key_file.exists():
+                with atomic_write(key_file) as f:
+                    f.write(Fernet.generate_key().decode())
+            return key_file.read_text().strip().encode()
+
+    def _read(self):
+        try:
+            mtime = self._file.stat().st_mtime_ns
+            if mtime == self._mtime:
+                return self._entries
+            data = self._fernet.decrypt(self._file.read_bytes())
+            self._entries, self._mtime = json.loads(data.decode()), mtime
+        except FileNotFoundError:
+            self._entries, self._mtime = {}, None
+        except (self._invalid_token, ValueError):
+            # Written with another key, or corrupted: start over
+            self._entries, self._mtime = {}, None
+        return self._entries
+
+    def get(self, key):
+        with self._lock:
+            return fresh(self._read().get(key))
+
+    def set(self, key, value, expires):
+        self.set_many([(key, value, expires)])
+
+    def set_many(self, items):
+        self._dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+        with self._lock, FileLock(f'{self._file}.lock'):
+            entries = evict(dict(self._read()))
+            entries.update({k: {'expires': e, 'value': v} for k, v, e in items})
+            with atomic_write(self._file) as f:
+                f.write(self._fernet.encrypt(json.dumps(entries).encode()).decode())
+            self._entries, self._mtime = entries, self._file.stat().st_mtime_ns
+
+
+class SharedFileCache():
+    """Credentials cache in a memory mapped file, shared by processes of a host.
+
+    Parallel jobs pointing at the same file (AWSSSO_SHARED_CACHE, /dev/shm
+    is a good place) reuse each other's credentials instead of each assuming
+    the role. Entries are only parsed again when the generation counter of
+    the header changed. The file is not encrypted, it is only readable by
+    its owner.
+    """
+
+    MAGIC = b'ASC1'
+    HEADER = struct.Struct('<4sQI')
+
+    def __init__(self, cache_dir, path=None):
+        path = path or os.environ.get('AWSSSO_SHARED_CACHE') or Path(cache_dir) / 'cache' / 'shared.bin'
+        self._path = Path(path)
+        self._path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        self._fd = os.open(str(self._path), os.O_RDWR | os.O_CREAT, 0o600)
+        self._lock = threading.Lock()
+        self._map = None
+        self._generation = None
+        self._entries = {}
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _remap(self, size=None):
+        if size is not None and os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        size = os.fstat(self._fd).st_size
+        if size < SharedFileCache.HEADER.size:
+            return None
+        if self._map is None or len(self._map) != size:
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._fd, size)
+        return self._map
+
+    def _read(self):
+        m = self._remap()
+        if m is None:
+            return {}
+        magic, generation, length = SharedFileCache.HEADER.unpack_from(m)
+        if magic != SharedFileCache.MAGIC:
+            return {}
+        if generation != self._generation:
+            start = SharedFileCache.HEADER.size
+            try:
+                self._entries = json.loads(m[start:start + length].decode())
+            except ValueError:
+                self._entries = {}
+            self._generation = generation
+        return self._entries
+
+    def _write(self, entries):
+        payload = json.dumps(entries).encode()
+        size = SharedFileCache.HEADER.size + len(payload)
+        m = self._remap()
+        if m is None or len(m) < size:
+            # Grow by doubling, so that the file is rarely resized
+            m = self._remap(max(size, 2 * len(m) if m is not None else 4096))
+        generation = (self._generation or 0) + 1
+        m[SharedFileCache.HEADER.size:size] = payload
+        SharedFileCache.HEADER.pack_into(m, 0, SharedFileCache.MAGIC, generation, len(payload))
+        self._entries, self._generation = entries, generation
+
+    def get(self, key):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+            try:
+                return fresh(self._read().get(key))
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def set(self, key, value, expires):
+        self.set_many([(key, value, expires)])
+
+    def set_many(self, items):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                entries = evict(dict(self._read()))
+                entries.update({k: {'expires': e, 'value': v} for k, v, e in items})
+                self._write(entries)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+CACHES = {
+    'memory': MemoryCache,
+    'file': EncryptedFileCache,
+    'shared': SharedFileCache
+}
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name, cache_dir):
+    """Return the process wide instance of the `name` cache backend."""
+    if name not in CACHES:
+        raise Error(f'unknown credentials cache {name} (expected one of {", ".join(CACHES)})')
+    with _caches_lock:
+        if (name, str(cache_dir)) not in _caches:
+            _caches[(name, str(cache_dir))] = CACHES[name](cache_dir)
+        return _caches[(name, str(cache_dir))]
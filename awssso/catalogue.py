@@ -0,0 +1,133 @@
+import json
+import threading
+from hashlib import sha256
+from pathlib import Path
+from time import time
+
+from awssso.filelock import FileLock, atomic_write
+
+DEFAULT_TTL = 86400
+
+
+class Catalogue():
+    """On-disk cache of the AWS accounts (app instances) and profiles of a portal user.
+
+    Entries expire after `ttl` seconds; a `ttl` of 0 disables the cache.
+    """
+
+    def __init__(self, cache_dir, url, username, ttl=DEFAULT_TTL):
+        self._dir = Path(cache_dir) / 'catalogue'
+        self._file = self._dir / f'{sha256(f"{username}@{url}".encode()).hexdigest()}.json'
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._data = None
+
+    @classmethod
+    def from_params(cls, cache_dir, params):
+        return cls(cache_dir, params.get('url'), params.get('username'), int(params.get('catalogue_ttl', DEFAULT_TTL)))
+
+    @property
+    def enabled(self):
+        return self._ttl > 0
+
+    def _fresh(self, entry):
+        return entry is not None and time() - entry['updated'] < self._ttl
+
+    def _read(self):
+        try:
+            with self._file.open() as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {'instances': None, 'profiles': {}}
+
+    def _load(self):
+        if self._data is None:
+            self._data = self._read()
+        return self._data
+
+    def _evict(self, data):
+        if not self._fresh(data['instances']):
+            data['instances'] = None
+        data['profiles'] = {k: v for k, v in data['profiles'].items() if self._fresh(v)}
+        return data
+
+    def _save(self, update):
+        self._dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+        with FileLock(f'{self._file}.lock'):
+            # Merge with what other processes may have written meanwhile
+            data = self._read()
+            update(data)
+            self._data = self._evict(data)
+            with atomic_write(self._file) as f:
+                json.dump(self._data, f)
+
+    def instances(self):
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._load()['instances']
+            return entry['value'] if self._fresh(entry) else None
+
+    def set_instances(self, instances):
+        if not self.enabled:
+            return
+        entry = {'updated': time(), 'value': instances}
+        with self._lock:
+            self._save(lambda data: data.update(instances=entry))
+
+    def profiles(self, instance_id):
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._load()['profiles'].get(instance_id)
+            return entry['value'] if self._fresh(entry) else None
+
+    def set_profiles(self, instance_id, profiles):
+        self.set_many_profiles({instance_id: profiles})
+
+    def set_many_profiles(self, profiles):
+        """Store the profiles of several instances (dict by instance id) in one write."""
+        if not self.enabled or not profiles:
+            return
+        updated = time()
+        entries = {k: {'updated': updated, 'value': v} for k, v in profiles.items()}
+        with self._lock:
+            self._save(lambda data: data['profiles'].update(entries))
+
+    def profile_url(self, instance_id, profile_id):
+        for profile in self.profiles(instance_id) or []:
+            if profile['id'] == profile_id:
+                return profile['url']
+        return None
+
+    def invalidate(self, instance_id=None):
+        def update(data):
+            if instance_id:
+                data['profiles'].pop(instance_id, None)
+            else:
+                data.update(instances=None, profiles={})
+
+        with self._lock:
+            self._save(update)
+
+    def clear(self):
+        with self._lock:
+            self._data = None
+            try:
+                self._file.unlink()
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def prune(cache_dir, ttl=DEFAULT_TTL):
+        """Remove catalogues that have not been updated for `ttl` seconds."""
+        pruned = []
+        for path in (Path(cache_dir) / 'catalogue').glob('*.json'):
+            if time() - path.stat().st_mtime > ttl:
+                for _ in (path, Path(f'{path}.lock')):
+                    try:
+                        _.unlink()
+                    except FileNotFoundError:
+                        pass
+                pruned.append(path)
+        return pruned
@@ -1,37 +1,48 @@
 import argparse
-import json
 import os
-import subprocess
 import sys
-import webbrowser
 from time import time
 
-import inquirer
-from halo import Halo
-
-from awssso import __version__
+from awssso.cache import Error as CacheError
 from awssso.config import Configuration
-from awssso.helpers import (SPINNER_MSGS, CredentialsHelper, SecretsManager,
-                            config_override, validate_empty, validate_url)
-from awssso.saml import AssumeRoleValidationError, BotoClientError, SAMLHelper
-from awssso.ssoclient import SSOClient
-from awssso.ssodriver import AlertMessage, MFACodeNeeded, SSODriver
+from awssso.config import Error as ConfigError
+from awssso.helpers import (SPINNER_MSGS, TOKEN_LOCK_STALE, TOKEN_LOCK_TIMEOUT,
+                            SecretsManager, config_override,
+                            get_or_assume_credentials, get_or_assume_roles,
+                            json_serial, refresh_due, refresh_window,
+                            single_flight, spawn_refresh, token_lock_name,
+                            validate_empty, validate_url)
+from awssso.saml import AssumeRoleValidationError, BotoClientError, RoleNotFound
+from awssso.timings import span, tracer
+
+# Heavy modules (inquirer, halo, selenium, requests, boto3) are imported
+# where they are needed, so that cached credentials are served quickly.
 
 
-def __refresh_token(url, username, password, config_dir, headless=True, spinner=True):
+def __drive_login(driver_class, url, username, password, config_dir, headless=True, spinner=True):
+    import inquirer
+    from halo import Halo
+    from awssso.ssodriver import AlertMessage, MFACodeNeeded
+
     spinner = Halo(enabled=spinner)
     try:
         spinner.start(SPINNER_MSGS['token_refresh'])
-        driver = SSODriver(url, username, headless=headless, cookie_dir=config_dir)
+        driver = driver_class(url, username, headless=headless, cookie_dir=config_dir)
         try:
-            return driver.refresh_token(username, password)
+            with span('signin.refresh_token'):
+                return driver.refresh_token(username, password)
         except MFACodeNeeded as e:
             spinner.stop()
-            mfacode = inquirer.text(message='MFA Code')
+            if not sys.stdin.isatty():
+                sys.exit('MFA code needed, run "awssso login" from a terminal')
+            with span('signin.mfa_prompt'):
+                mfacode = inquirer.text(message='MFA Code')
             spinner.start(SPINNER_MSGS['mfa_send'])
-            driver.send_mfa(e.mfa_form, mfacode)
+            with span('signin.send_mfa'):
+                driver.send_mfa(e.mfa_form, mfacode)
             spinner.start(SPINNER_MSGS['token_refresh'])
-            return driver.get_token()
+            with span('signin.get_token'):
+                return driver.get_token()
         except AlertMessage as e:
             sys.exit(e)
         finally:
@@ -43,20 +54,113 @@ def __refresh_token(url, username, password, config_dir, headless=True, spinner=
         driver.close()
 
 
-def __get_or_refresh_token(url, username, password, secrets, config_dir, force_refresh=False, headless=True, spinner=True):
-    token = secrets.get('authn-token')
-    stored_password = secrets.get('credentials')
-    expiry_date = int(secrets.get('authn-expiry-date', '0'))
-    if (force_refresh) or (not token) or (time() > expiry_date) or (stored_password != password):
-        token, expiry_date = __refresh_token(url, username, password, config_dir, headless, spinner)
-        if stored_password != password:
-            secrets.set('credentials', password)
-        secrets.set('authn-token', token)
-        secrets.set('authn-expiry-date', str(expiry_date))
-    return token
+def __refresh_token(url, username, password, config_dir, headless=True, spinner=True, engine='selenium', transport=None):
+    if engine == 'http':
+        from functools import partial
+        from awssso.ssohttp import SSOHTTPDriver, UnsupportedPortal
+
+        try:
+            with span('signin', engine='http'):
+                return __drive_login(partial(SSOHTTPDriver, transport=transport), url, username, password, config_dir, headless, spinner)
+        except UnsupportedPortal:
+            # Sign in page needs a browser, fall back to Selenium
+            pass
+
+    with span('signin', engine='selenium'):
+        from awssso.ssodriver import SSODriver
+
+        return __drive_login(SSODriver, url, username, password, config_dir, headless, spinner)
+
+
+def __read_token(secrets):
+    return secrets.get('authn-token'), secrets.get('credentials'), int(secrets.get('authn-expiry-date', '0'))
+
+
+def __get_or_refresh_token(url, username, password, secrets, config_dir, force_refresh=False, headless=True, spinner=True, engine='selenium',
+                           transport=None):
+    with span('token', refreshed=False) as s:
+        token, stored_password, expiry_date = __read_token(secrets)
+        if (force_refresh) or (not token) or (time() > expiry_date) or (stored_password != password):
+            # One process signs in at a time for a username / url, the others
+            # wait for it and use its token instead of opening more browsers.
+            with single_flight(config_dir, token_lock_name(url, username), TOKEN_LOCK_TIMEOUT, TOKEN_LOCK_STALE):
+                secrets.reload()
+                latest, stored_password, expiry_date = __read_token(secrets)
+                if latest and latest != token and time() < expiry_date and stored_password == password:
+                    return latest
+
+                s.set('refreshed', True)
+                token, expiry_date = __refresh_token(url, username, password, config_dir, headless, spinner, engine, transport)
+                with secrets.batch():
+                    if stored_password != password:
+                        secrets.set('credentials', password)
+                    secrets.set('authn-token', token)
+                    secrets.set('authn-expiry-date', str(expiry_date))
+        return token
+
+
+def __transport(params, **kwargs):
+    from awssso.transport import get_transport, transport_settings
+
+    return get_transport(**{**transport_settings(params), **kwargs})
+
+
+def __sso_client(cfg, profile, params, secrets, args, catalogue=None, **kwargs):
+    from awssso.catalogue import Catalogue
+    from awssso.ssoclient import SSOClient
+
+    password = secrets.get('credentials')
+    if not password:
+        sys.exit(f'Cannot get password from secrets, run "awssso configure -p {profile}"')
+
+    token = __get_or_refresh_token(
+        params['url'], params['username'], password,
+        secrets, cfg.configdir, args.force_refresh, args.headless, args.spinner,
+        args.engine or params.get('engine', 'selenium'), __transport(params, **kwargs)
+    )
+    catalogue = catalogue or Catalogue.from_params(cfg.configdir, params)
+    return SSOClient(token, params['region'], catalogue, __transport(params, **kwargs))
+
+
+def __set_aws_profiles(profiles, aws_configure=False, credentials_file=None):
+    if aws_configure:
+        import subprocess
+
+        with span('output.aws_configure', profiles=len(profiles)):
+            for aws_profile, credentials in profiles.items():
+                for cmd in credentials.to_cli_cmds(aws_profile):
+                    subprocess.run(cmd)
+    else:
+        from awssso.credentialsfile import CredentialsFile
+
+        with span('output.credentials_file', profiles=len(profiles)):
+            if credentials_file == '-':
+                print('\n'.join(CredentialsFile.merge([], {k: v.cli for k, v in profiles.items()})))
+            else:
+                CredentialsFile(credentials_file).update({k: v.cli for k, v in profiles.items()})
+
+
+def __output_profiles(profiles, args):
+    # Credentials of several AWS CLI profiles, written at once
+    if args.json:
+        import json
+
+        with span('output.json', profiles=len(profiles)):
+            print(json.dumps({k: v.process for k, v in profiles.items()}, default=json_serial))
+    elif args.env_dir:
+        from awssso.credentialsfile import write_env_files
+
+        with span('output.env_dir', profiles=len(profiles)):
+            write_env_files(args.env_dir, {k: v.env for k, v in profiles.items()})
+    else:
+        __set_aws_profiles(profiles, args.aws_configure, args.credentials_file)
 
 
 def configure(args):
+    import inquirer
+    from awssso.catalogue import Catalogue
+    from awssso.ssoclient import SSOClient
+
     profile = args.profile
     cfg = Configuration()
     params = config_override(cfg.config, profile, args)
@@ -67,14 +171,15 @@ def configure(args):
             inquirer.Text('aws_profile', message='AWS CLI profile', default=params.get('aws_profile', profile), validate=validate_empty),
             inquirer.Text('username', message='Username', default=params.get('username', ''), validate=validate_empty)
         ], answers=params, raise_keyboard_interrupt=True)
-        secrets = SecretsManager(params.get('username'), params.get('url'))
+        secrets = SecretsManager.from_params(params, cfg.configdir)
         password = inquirer.password(message='Password', default=secrets.get('credentials', ''), validate=validate_empty)
 
         token = __get_or_refresh_token(
             params['url'], params['username'], password,
-            secrets, cfg.configdir, args.force_refresh, args.headless, args.spinner
+            secrets, cfg.configdir, args.force_refresh, args.headless, args.spinner,
+            args.engine or params.get('engine', 'selenium'), __transport(params)
         )
-        sso = SSOClient(token, params['region'])
+        sso = SSOClient(token, params['region'], Catalogue.from_params(cfg.configdir, params), __transport(params))
 
         instances = sso.get_instances()
         inquirer.prompt([
@@ -99,7 +204,115 @@ def configure(args):
         sys.exit(1)
 
 
+def __login_all(args):
+    from fnmatch import fnmatch
+    from threading import Lock
+    from awssso import bulk
+    from awssso.catalogue import Catalogue
+    from awssso.ssoclient import SSOClient
+
+    if args.export or args.interactive:
+        sys.exit('--all can not be used with --export or --interactive')
+    if args.role or args.all_roles:
+        sys.exit('--all can not be used with --role or --all-roles')
+
+    cfg = Configuration()
+    patterns = args.all or ['*']
+    profiles = [_ for _ in cfg.profiles() if any(fnmatch(_, p) for p in patterns)]
+    if not profiles:
+        sys.exit(f'no profile matches {" ".join(patterns)}')
+
+    # One authn token is shared by all profiles of the same username / url,
+    # tokens are refreshed one at a time since it may prompt for a MFA code.
+    token_lock = Lock()
+    tokens = {}
+    secrets = {}
+    catalogues = {}
+
+    def get_token(params, key):
+        with token_lock:
+            if key not in tokens:
+                password = secrets[key].get('credentials')
+                if not password:
+                    raise ValueError(f'Cannot get password from secrets for {params["username"]}')
+                tokens[key] = __get_or_refresh_token(
+                    params['url'], params['username'], password,
+                    secrets[key], cfg.configdir, args.force_refresh, args.headless, args.spinner,
+                    args.engine or params.get('engine', 'selenium'), __transport(params)
+                )
+            return tokens[key]
+
+    def job(profile):
+        params = config_override(cfg.config, profile, args, keep=['url', 'region', 'username'])
+        if 'instance_id' not in params or 'profile_id' not in params:
+            raise ValueError(f'profile is not configured, use "awssso configure -p {profile}"')
+
+        key = (params.get('username'), params.get('url'))
+        with token_lock:
+            if key not in secrets:
+                secrets[key] = SecretsManager.from_params(params, cfg.configdir)
+                catalogues[key] = Catalogue.from_params(cfg.configdir, params)
+
+        credentials = get_or_assume_credentials(
+            secrets[key], lambda: SSOClient(get_token(params, key), params['region'], catalogues[key], __transport(params)),
+            params['instance_id'], params['profile_id'], args.duration, args.renew, cfg.configdir,
+            transport=__transport(params)
+        )
+        if args.console:
+            return credentials.to_console_url(args.duration, __transport(params), secrets[key])
+        return credentials
+
+    try:
+        results = list(bulk.run({_: (lambda p=_: job(p)) for _ in profiles}, args.workers))
+    except KeyboardInterrupt:
+        sys.exit(1)
+
+    if args.console:
+        width = max(len(_.profile) for _ in results)
+        for result in sorted([_ for _ in results if _.ok], key=lambda _: _.profile):
+            print(f'{result.profile:{width}}  {result.value}')
+            if args.browser:
+                import webbrowser
+
+                webbrowser.open_new_tab(result.value)
+    elif not args.cache_only:
+        __output_profiles({
+            cfg.config[_.profile].get('aws_profile', _.profile): _.value for _ in results if _.ok
+        }, args)
+
+    bulk.report(results, sys.stderr)
+    if not all(_.ok for _ in results):
+        sys.exit(1)
+
+
+def __login_roles(args, cfg, params, secrets, sso_factory, aws_profile):
+    from awssso import bulk
+
+    if args.export or args.console:
+        sys.exit('several roles can not be used with --export or --console')
+
+    results = get_or_assume_roles(
+        secrets, sso_factory, params['instance_id'], params['profile_id'],
+        None if args.all_roles else args.role, args.duration, args.renew, cfg.configdir, args.workers,
+        __transport(params)
+    )
+    if args.cache_only:
+        return
+
+    # Each role gets its own AWS CLI profile, named after the role
+    __output_profiles({
+        f'{aws_profile}-{arn.split("/")[-1]}': _.value for arn, _ in results.items() if _.ok
+    }, args)
+
+    bulk.report(list(results.values()), sys.stderr)
+    if not all(_.ok for _ in results.values()):
+        sys.exit(1)
+
+
 def login(args):
+    if args.all is not None:
+        return __login_all(args)
+
     profile = args.profile
     cfg = Configuration()
 
@@ -108,20 +321,31 @@ def login(args):
 
     params = config_override(cfg.config, profile, args)
     aws_profile = params.get('aws_profile', profile)
-    secrets = SecretsManager(params.get('username'), params.get('url'))
-    password = secrets.get('credentials')
+    secrets = SecretsManager.from_params(params, cfg.configdir)
 
-    if not password:
-        sys.exit(f'Cannot get password from secrets, run "awssso configure -p {profile}"')
+    if args.cache_only:
+        from awssso.filelock import FileLock, LockTimeout
+
+        # Background refreshes of the same profile must not pile up
+        try:
+            FileLock(cfg.configdir / f'refresh.{profile}.lock', timeout=0).acquire()
+        except LockTimeout:
+            return
+
+    def sso_client():
+        return __sso_client(cfg, profile, params, secrets, args)
 
     try:
-        token = __get_or_refresh_token(
-            params['url'], params['username'], password,
-            secrets, cfg.configdir, args.force_refresh, args.headless, args.spinner
-        )
-        sso = SSOClient(token, params['region'])
+        # Only get a token upfront when it is required, cached credentials
+        # can be served without it.
+        sso_factory = sso_client
+        if args.interactive or args.force_refresh:
+            sso = sso_client()
+            sso_factory = lambda: sso  # noqa: E731
 
         if args.interactive:
+            import inquirer
+
             instances = sso.get_instances()
             inquirer.prompt([
                 inquirer.List(
@@ -140,36 +364,148 @@ def login(args):
                 )
             ], answers=params, raise_keyboard_interrupt=True)
 
-        cache_key = f"{params['instance_id']}.{params['profile_id']}.credentials"
-        cached_credentials = secrets.get(cache_key)
+        if args.all_roles or len(args.role or []) > 1:
+            return __login_roles(args, cfg, params, secrets, sso_factory, aws_profile)
 
-        if cached_credentials:
-            credentials = CredentialsHelper(json.loads(cached_credentials))
+        credentials = get_or_assume_credentials(
+            secrets, sso_factory,
+            params['instance_id'], params['profile_id'], args.duration, args.renew, cfg.configdir,
+            args.role[0] if args.role else None, __transport(params)
+        )
+
+        if args.cache_only:
+            return
 
-        if not cached_credentials or credentials.expired or args.renew:
-            payload = sso.get_saml_payload(params['instance_id'], params['profile_id'])
-            saml = SAMLHelper(payload)
-            credentials = CredentialsHelper(saml.assume_role(args.duration)['Credentials'])
-            secrets.set(cache_key, credentials.json)
+        refresh_ahead = int(args.refresh_ahead if args.refresh_ahead is not None else params.get('refresh_ahead', 0))
+        if refresh_ahead:
+            token_due = refresh_due(int(secrets.get('authn-expiry-date', '0')), refresh_ahead)
+            if token_due or refresh_due(credentials.expires, refresh_window(refresh_ahead, credentials.lifetime or args.duration)):
+                spawn_refresh(profile, params['region'], token_due)
 
         if args.export:
-            print('\n'.join(credentials.to_exports()))
+            with span('output.export'):
+                print('\n'.join(credentials.to_exports()))
         elif args.json:
-            print(credentials.to_json())
+            with span('output.json'):
+                print(credentials.to_json())
         elif args.console:
-            signin_url = credentials.to_console_url(args.duration)
-            print(signin_url)
+            with span('output.console'):
+                signin_url = credentials.to_console_url(args.duration, __transport(params), secrets)
+                print(signin_url)
             if args.browser:
+                import webbrowser
+
                 webbrowser.open_new_tab(signin_url)
         else:
-            for cmd in credentials.to_cli_cmds(aws_profile):
-                subprocess.run(cmd)
+            __output_profiles({aws_profile: credentials}, args)
     except (AssumeRoleValidationError, BotoClientError) as e:
         sys.exit(f'{e} (request id: {e.request_id})')
+    except RoleNotFound as e:
+        sys.exit(str(e))
     except KeyboardInterrupt:
         sys.exit(1)
 
 
+def catalogue(args):
+    from awssso.catalogue import Catalogue
+
+    profile = args.profile
+    cfg = Configuration()
+
+    if args.action == 'prune':
+        for path in Catalogue.prune(cfg.configdir, args.ttl):
+            print(f'removed {path}')
+        return
+
+    if profile not in cfg.config:
+        sys.exit(f'profile {profile} does not exist, use "awssso configure -p {profile}" to create it')
+
+    params = config_override(cfg.config, profile, args)
+    cat = Catalogue.from_params(cfg.configdir, params)
+
+    if args.action == 'clear':
+        cat.clear()
+        return
+
+    secrets = SecretsManager.from_params(params, cfg.configdir)
+
+    try:
+        sso = __sso_client(cfg, profile, params, secrets, args, cat)
+        instances = sso.get_instances(refresh=True)
+        for _ in sso.iter_profiles(instances, refresh=True):
+            pass
+        print(f'{len(instances)} AWS accounts cached')
+    except KeyboardInterrupt:
+        sys.exit(1)
+
+
+def list_profiles(args):
+    import json
+
+    profile = args.profile
+    cfg = Configuration()
+
+    if profile not in cfg.config:
+        sys.exit(f'profile {profile} does not exist, use "awssso configure -p {profile}" to create it')
+
+    params = config_override(cfg.config, profile, args)
+    secrets = SecretsManager.from_params(params, cfg.configdir)
+
+    try:
+        sso = __sso_client(cfg, profile, params, secrets, args, pool_size=args.workers)
+        instances = sso.get_instances(refresh=args.refresh)
+
+        if args.output == 'table':
+            print(f'{"INSTANCE ID":20}  {"PROFILE ID":20}  {"ACCOUNT":40}  ROLE', flush=True)
+        for instance, profiles in sso.iter_profiles(instances, args.workers, args.refresh):
+            for p in profiles:
+                if args.output == 'table':
+                    print(f'{instance["id"]:20}  {p["id"]:20}  {instance["name"]:40}  {p["name"]}', flush=True)
+                else:
+                    print(json.dumps({
+                        'instance_id': instance['id'],
+                        'account': instance['name'],
+                        'account_id': instance.get('searchMetadata', {}).get('AccountId'),
+                        'profile_id': p['id'],
+                        'role': p['name']
+                    }), flush=True)
+    except KeyboardInterrupt:
+        sys.exit(1)
+
+
+def daemon(args):
+    from awssso.daemon import serve
+
+    try:
+        serve(args.socket, args.idle_timeout, args.refresh_ahead, args.browser_pool, args.browser_idle_timeout)
+    except KeyboardInterrupt:
+        sys.exit(1)
+
+
+def serve(args):
+    from awssso import server
+
+    try:
+        server.serve(
+            args.host, args.port, args.token_file, args.patterns, args.workers,
+            args.refresh_ahead, args.browser_pool, args.browser_idle_timeout
+        )
+    except KeyboardInterrupt:
+        sys.exit(1)
+    except OSError as e:
+        sys.exit(f'Cannot serve credentials on {args.host}:{args.port}: {e}')
+
+
+class VersionAction(argparse.Action):
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS, help="show program's version number and exit"):
+        super().__init__(option_strings=option_strings, dest=dest, default=default, nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        from awssso import __version__
+
+        parser.exit(message=f'{__version__}\n')
+
+
 class DurationAction(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
         if values < 900:
@@ -186,10 +522,17 @@ def main():
     default_aws_profile = default_aws_profile or os.environ.get('AWS_DEFAULT_PROFILE')
 
     parser = argparse.ArgumentParser()
-    parser.add_argument('--version', action='version', version=__version__)
+    parser.add_argument('--version', action=VersionAction)
     parser.add_argument('--region', default=default_region, help='AWS SSO region (default: AWSSSO_REGION, AWS_DEFAULT_REGION, eu-west-1)')
     parser.add_argument('--no-headless', dest='headless', action='store_false', default=True, help='show web browser')
+    parser.add_argument('--engine', choices=['selenium', 'http'],
+                        help='authentication engine, http signs in without a browser and falls back to selenium (default: engine setting, selenium)')
+    parser.add_argument('--debug', action='store_true', default=False, help='log debug messages, such as sign in stage timings')
     parser.add_argument('--no-spinner', dest='spinner', action='store_false', default=True, help='disable all spinners')
+    parser.add_argument('--timings', action='store_true', default=False, help='print the time spent in each step of the command to stderr')
+    parser.add_argument('--timings-format', choices=['table', 'json'], default='table', help='format of --timings (default: table)')
+    parser.add_argument('--timings-file', metavar='PATH',
+                        help='append the timed steps to PATH as OpenTelemetry like JSON lines (default: AWSSSO_TIMINGS_FILE)')
     subparsers = parser.add_subparsers(title='subcommands')
 
     parent_parser = argparse.ArgumentParser(add_help=False)
@@ -207,18 +550,89 @@ def main():
     login_parser_group = login_parser.add_mutually_exclusive_group()
     login_parser_group.add_argument('-e', '--export', action='store_true', default=False, help='output credentials as environment variables')
     login_parser_group.add_argument('-j', '--json', action='store_true', default=False,
-                                    help='output credentials in JSON format (see https://docs.aws.amazon.com/cli/latest/userguide/cli-configure-sourcing-external.html)')
+                                    help='output credentials in JSON format (see https://docs.aws.amazon.com/cli/latest/userguide/cli-configure-sourcing-external.html), '
+                                         'a JSON object by AWS CLI profile with --all or several roles')
     login_parser_group.add_argument('-c', '--console', action='store_true', default=False, help='output AWS Console Sign In url')
+    login_parser_group.add_argument('--cache-only', action='store_true', default=False, help='only refresh the credentials cache, without any output')
+    login_parser_group.add_argument('--env-dir', metavar='DIR', help='write credentials to a DIR/AWS_PROFILE.env dotenv file per AWS CLI profile')
+    login_parser_group.add_argument('--credentials-file', metavar='PATH',
+                                    help='set AWS CLI profiles in PATH instead of the AWS CLI credentials file, - prints them (default: AWS_SHARED_CREDENTIALS_FILE)')
     login_parser.add_argument('-b', '--browser', action='store_true', default=False, help='open web browser with AWS Console Sign In url')
     login_parser.add_argument('-i', '--interactive', action='store_true', default=False, help='interactively choose AWS account and role')
     login_parser.add_argument('-r', '--renew', action='store_true', default=False, help='ignore cached credentials and renew them')
+    login_parser.add_argument('--refresh-ahead', type=int, metavar='SECONDS',
+                              help='renew credentials and authn token in the background when they expire within SECONDS (default: refresh_ahead setting, 0)')
+    login_parser.add_argument('--aws-configure', action='store_true', default=False,
+                              help='set AWS CLI profile credentials by invoking "aws configure" instead of writing the credentials file')
+    login_parser.add_argument('--all', nargs='*', metavar='PATTERN',
+                              help='login every configured profile, or those matching PATTERN (glob); with -c, output their console urls')
+    login_parser.add_argument('--role', action='append', metavar='ROLE_ARN',
+                              help='role of the SAML assertion to assume instead of the first one, may be repeated to assume several roles')
+    login_parser.add_argument('--all-roles', action='store_true', default=False, help='assume every role of the SAML assertion')
+    login_parser.add_argument('-w', '--workers', type=int, default=8,
+                              help='number of profiles (--all) or roles (--role, --all-roles) logged in concurrently (default: 8)')
     login_parser.set_defaults(func=login)
 
+    list_parser = subparsers.add_parser('list', parents=[parent_parser], help='list AWS accounts and roles available to the profile')
+    list_parser.add_argument('-o', '--output', choices=['json', 'table'], default='json', help='output JSON lines or a table (default: json)')
+    list_parser.add_argument('-w', '--workers', type=int, default=10, help='number of concurrent portal requests (default: 10)')
+    list_parser.add_argument('--refresh', action='store_true', default=False, help='ignore the catalogue and fetch accounts and roles from the portal')
+    list_parser.set_defaults(func=list_profiles)
+
+    catalogue_parser = subparsers.add_parser('catalogue', parents=[parent_parser], help='manage the cache of AWS accounts and roles')
+    catalogue_parser.add_argument('action', nargs='?', choices=['refresh', 'clear', 'prune'], default='refresh',
+                                  help='refresh the catalogue of the profile, clear it, or prune catalogues unused for --ttl seconds (default: refresh)')
+    catalogue_parser.add_argument('--ttl', type=int, default=86400, help='age (seconds) of catalogues removed by prune (default: 86400)')
+    catalogue_parser.set_defaults(func=catalogue)
+
+    daemon_parser = subparsers.add_parser('daemon', help='run the credential broker daemon used by awssso-client')
+    daemon_parser.add_argument('--socket', help='path of the Unix socket (default: AWSSSO_DAEMON_SOCKET, ~/.awssso/daemon.sock)')
+    daemon_parser.add_argument('--idle-timeout', type=int, default=900, help='exit after this many idle seconds, 0 to disable (default: 900)')
+    daemon_parser.add_argument('--refresh-ahead', type=int, default=0, metavar='SECONDS',
+                               help='renew credentials in the background when they expire within SECONDS, 0 to disable (default: 0)')
+    daemon_parser.add_argument('--browser-pool', type=int, default=0, metavar='SIZE',
+                               help='keep up to SIZE headless browsers warm to refresh expired authn tokens, 0 to disable (default: 0)')
+    daemon_parser.add_argument('--browser-idle-timeout', type=int, default=600, metavar='SECONDS',
+                               help='shut down pooled browsers idle for SECONDS (default: 600)')
+    daemon_parser.set_defaults(func=daemon)
+
+    serve_parser = subparsers.add_parser('serve', help='serve credentials over HTTP to AWS SDKs (AWS_CONTAINER_CREDENTIALS_FULL_URI)')
+    serve_parser.add_argument('patterns', nargs='*', metavar='PATTERN', help='only serve profiles matching PATTERN (glob, default: all)')
+    serve_parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    serve_parser.add_argument('--port', type=int, default=9911, help='port to listen on (default: 9911)')
+    serve_parser.add_argument('--token-file', metavar='PATH',
+                              help='file holding the token clients must send, generated if missing (default: ~/.awssso/serve.token)')
+    serve_parser.add_argument('--workers', type=int, default=16, help='requests handled concurrently (default: 16)')
+    serve_parser.add_argument('--refresh-ahead', type=int, default=900, metavar='SECONDS',
+                              help='renew served credentials in the background when they expire within SECONDS, 0 to disable (default: 900)')
+    serve_parser.add_argument('--browser-pool', type=int, default=0, metavar='SIZE',
+                              help='keep up to SIZE headless browsers warm to refresh expired authn tokens, 0 to disable (default: 0)')
+    serve_parser.add_argument('--browser-idle-timeout', type=int, default=600, metavar='SECONDS',
+                              help='shut down pooled browsers idle for SECONDS (default: 600)')
+    serve_parser.set_defaults(func=serve)
+
     args = parser.parse_args()
 
+    if args.debug:
+        import logging
+
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    timings_file = args.timings_file or os.environ.get('AWSSSO_TIMINGS_FILE')
+    if args.timings or timings_file:
+        tracer.enable()
+
     try:
         func = args.func
         if callable(func):
-            func(args)
+            with span('awssso', command=func.__name__):
+                func(args)
     except AttributeError:
         parser.print_help(sys.stderr)
+    except (CacheError, ConfigError) as e:
+        sys.exit(str(e))
+    finally:
+        if args.timings:
+            tracer.report(args.timings_format)
+        if timings_file:
+            tracer.export(timings_file)
@@ -0,0 +1,105 @@
+"""Lightweight credential_process client for the awssso daemon.
+
+Only the standard library is imported here so that a warm daemon answers
+in a few milliseconds; anything the daemon can not serve falls back to the
+regular `awssso login --json` command.
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+from time import sleep, time
+
+DEFAULT_IDLE_TIMEOUT = 900
+CONNECT_TIMEOUT = 5
+SPAWN_TIMEOUT = 3
+
+
+def socket_path():
+    cfg_dir = os.path.expanduser(os.environ.get('AWSSSO_CONFIG_DIR', '~/.awssso'))
+    return os.environ.get('AWSSSO_DAEMON_SOCKET', os.path.join(cfg_dir, 'daemon.sock'))
+
+
+def request(path, payload, timeout=None):
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.settimeout(CONNECT_TIMEOUT)
+        s.connect(path)
+        s.settimeout(timeout)
+        s.sendall(json.dumps(payload).encode() + b'\n')
+        f = s.makefile('rb')
+        return json.loads(f.readline())
+    finally:
+        s.close()
+
+
+def spawn_daemon(idle_timeout=DEFAULT_IDLE_TIMEOUT, refresh_ahead=0):
+    import subprocess
+
+    with open(os.devnull, 'r+b') as devnull:
+        subprocess.Popen(
+            [sys.executable, '-m', 'awssso', 'daemon', '--idle-timeout', str(idle_timeout), '--refresh-ahead', str(refresh_ahead)],
+            stdin=devnull, stdout=devnull, stderr=devnull,
+            start_new_session=True, close_fds=True
+        )
+
+
+def connect(path, payload, idle_timeout=DEFAULT_IDLE_TIMEOUT, refresh_ahead=0):
+    try:
+        return request(path, payload)
+    except (FileNotFoundError, ConnectionRefusedError):
+        spawn_daemon(idle_timeout, refresh_ahead)
+
+    deadline = time() + SPAWN_TIMEOUT
+    while time() < deadline:
+        sleep(0.02)
+        try:
+            return request(path, payload)
+        except (FileNotFoundError, ConnectionRefusedError):
+            continue
+    return None
+
+
+def fallback(args):
+    cmd = [sys.executable, '-m', 'awssso', '--no-spinner', 'login', '-p', args.profile, '--json']
+    if args.duration:
+        cmd += ['-d', str(args.duration)]
+    if args.renew:
+        cmd += ['-r']
+    sys.stdout.flush()
+    os.execv(sys.executable, cmd)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='awssso-client', description='credential_process client for the awssso daemon')
+    parser.add_argument('-p', '--profile', default='default', help='AWS SSO Profile (default: default)')
+    parser.add_argument('-d', '--duration', type=int, help='duration (seconds) of the role session')
+    parser.add_argument('-r', '--renew', action='store_true', default=False, help='ignore cached credentials and renew them')
+    parser.add_argument('--idle-timeout', type=int, default=DEFAULT_IDLE_TIMEOUT,
+                        help=f'idle timeout (seconds) of a spawned daemon (default: {DEFAULT_IDLE_TIMEOUT})')
+    parser.add_argument('--refresh-ahead', type=int, default=0, metavar='SECONDS',
+                        help='a spawned daemon renews credentials expiring within SECONDS in the background (default: 0)')
+    parser.add_argument('--no-fallback', dest='fallback', action='store_false', default=True,
+                        help='do not fall back to "awssso login" when the daemon can not answer')
+    args = parser.parse_args()
+
+    payload = {'profile': args.profile, 'duration': args.duration, 'renew': args.renew}
+    try:
+        response = connect(socket_path(), payload, args.idle_timeout, args.refresh_ahead)
+    except (OSError, ValueError):
+        response = None
+
+    if response and 'credentials' in response:
+        print(response['credentials'])
+        return 0
+
+    if args.fallback:
+        fallback(args)
+
+    error = response.get('error') if response else 'awssso daemon is not available'
+    sys.exit(error)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
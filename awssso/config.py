@@ -1,22 +1,257 @@
 import configparser
+import json
 import os
+import threading
+from collections.abc import MutableMapping
 from pathlib import Path
 
+from awssso.filelock import FileLock, atomic_write
+
+SNAPSHOT_VERSION = 1
+INHERIT = 'inherit'
+PROFILES = 'profiles'
+TEMPLATE_PREFIX = 'template:'
+# Settings a section needs to be a profile
+PROFILE_KEYS = {'instance_id', 'profile_id'}
+DEFAULT_SECTION = configparser.DEFAULTSECT
+
+# Parsed configurations of the process, by path, valid while the file stamp matches
+_parsed = {}
+_parsed_lock = threading.Lock()
+
+
+class Error(Exception):
+    """Base class for configuration exceptions."""
+
+    def __init__(self, msg=''):
+        self.message = msg
+        Exception.__init__(self, msg)
+
+    def __repr__(self):
+        return self.message
+
+    __str__ = __repr__
+
+
+class ConfigSection(MutableMapping):
+    """Settings of a section, falling back on the DEFAULT section like configparser.SectionProxy."""
+
+    def __init__(self, name, values, defaults):
+        self.name = name
+        self._values = values
+        self._defaults = defaults
+
+    def __getitem__(self, key):
+        key = key.lower()
+        if key in self._values:
+            return self._values[key]
+        return self._defaults[key]
+
+    def __setitem__(self, key, value):
+        if not isinstance(value, str):
+            raise TypeError('option values must be strings')
+        self._values[key.lower()] = value
+
+    def __delitem__(self, key):
+        del self._values[key.lower()]
+
+    def __contains__(self, key):
+        return key.lower() in self._values or key.lower() in self._defaults
+
+    def __iter__(self):
+        return iter(dict.fromkeys([*self._values, *self._defaults]))
+
+    def __len__(self):
+        return len(dict.fromkeys([*self._values, *self._defaults]))
+
+    def __repr__(self):
+        return f'<Section: {self.name}>'
+
+
+class ConfigSections(MutableMapping):
+    """Sections of the configuration by name, used like a ConfigParser without interpolation."""
+
+    def __init__(self, sections=None, defaults=None):
+        self._sections = sections if sections is not None else {}
+        self._defaults = defaults if defaults is not None else {}
+
+    def __getitem__(self, name):
+        if name == DEFAULT_SECTION:
+            return ConfigSection(name, self._defaults, {})
+        return ConfigSection(name, self._sections[name], self._defaults)
+
+    def __setitem__(self, name, values):
+        values = {str(k).lower(): str(v) for k, v in values.items()}
+        if name == DEFAULT_SECTION:
+            self._defaults.clear()
+            self._defaults.update(values)
+        else:
+            self._sections[name] = values
+
+    def __delitem__(self, name):
+        del self._sections[name]
+
+    def __contains__(self, name):
+        return name == DEFAULT_SECTION or name in self._sections
+
+    def __iter__(self):
+        return iter([DEFAULT_SECTION, *self._sections])
+
+    def __len__(self):
+        return len(self._sections) + 1
+
+    def sections(self):
+        return list(self._sections)
+
+    def has_section(self, name):
+        return name in self._sections
+
+    def defaults(self):
+        return self._defaults
+
+    @classmethod
+    def from_parser(cls, parser):
+        defaults = dict(parser.defaults())
+        return cls({
+            name: {k: v for k, v in parser.items(name, raw=True) if defaults.get(k) != v} for name in parser.sections()
+        }, defaults)
+
+
+def _stamp(st):
+    return [st.st_mtime_ns, st.st_size, st.st_ino]
+
+
+def _expand(raw):
+    """Explicit sections over those generated by the `profiles` lines of templates."""
+    sections = {}
+    for name, values in raw.items():
+        for line in values.get(PROFILES, '').splitlines():
+            fields = line.split()
+            if not fields:
+                continue
+            if len(fields) not in (3, 4):
+                raise Error(f'[{name}] {PROFILES}: expected "name instance_id profile_id [aws_profile]", got "{line.strip()}"')
+            sections[fields[0]] = {**dict(zip(('instance_id', 'profile_id', 'aws_profile'), fields[1:])), INHERIT: name}
+    for name, values in raw.items():
+        sections[name] = {**sections.get(name, {}), **values}
+    return sections
+
+
+def _resolve(sections):
+    """Values of each section, completed with those of the section it inherits from."""
+    resolved = {}
+
+    def resolve(name, chain):
+        if name not in resolved:
+            values = sections[name]
+            base = values.get(INHERIT)
+            if base is None:
+                resolved[name] = values
+            elif base not in sections:
+                raise Error(f'[{name}] inherits from [{base}] which does not exist')
+            elif base in chain:
+                raise Error(f'inheritance cycle: {" -> ".join(chain + [base])}')
+            else:
+                inherited = resolve(base, chain + [base])
+                resolved[name] = {
+                    **{k: v for k, v in inherited.items() if k not in (INHERIT, PROFILES)},
+                    **values
+                }
+        return resolved[name]
+
+    for name in sections:
+        resolve(name, [name])
+    return resolved
+
+
+def _raw_parser():
+    # [DEFAULT] is read as an ordinary section, so that the values of each
+    # section are not mixed up with the defaults
+    return configparser.RawConfigParser(default_section='\0')
+
+
+def _raw_sections(parser):
+    """(sections, defaults) of a parser from _raw_parser."""
+    raw = {_: dict(parser[_]) for _ in parser.sections()}
+    return raw, raw.pop(DEFAULT_SECTION, {})
+
+
+def _parse(text, source, stamp):
+    parser = _raw_parser()
+    parser.read_string(text, source=source)
+    raw, defaults = _raw_sections(parser)
+    sections = _resolve(_expand(raw))
+    return {
+        'version': SNAPSHOT_VERSION,
+        'stamp': stamp,
+        'defaults': defaults,
+        'sections': sections,
+        # Values a section does not set itself, left out when it is saved
+        'inherited': {
+            name: {k: v for k, v in values.items() if k not in raw.get(name, {})}
+            for name, values in sections.items() if len(values) != len(raw.get(name, ()))
+        }
+    }
+
 
 class Configuration():
+    """Profiles of ~/.awssso/config.
+
+    The parsed file is kept in memory and in a snapshot next to it, both
+    valid until the file changes, so that large configurations are not
+    parsed again on each command.
+    """
+
     def __init__(self, cfg_dir=os.environ.get('AWSSSO_CONFIG_DIR', '~/.awssso')):
-        self._config = configparser.ConfigParser()
+        self._config = None
         self._config_dir = Path(cfg_dir).expanduser()
         self._config_file = Path(f'{self._config_dir.resolve()}/config')
+        self._snapshot_file = self._config_dir.resolve() / '.config.json'
 
-        self.__ensure_config_dir()
         self.__read()
 
     def __ensure_config_dir(self):
         self._config_dir.mkdir(exist_ok=True)
 
+    def __load(self):
+        key = str(self._config_file)
+        try:
+            stamp = _stamp(os.stat(key))
+        except FileNotFoundError:
+            self.__ensure_config_dir()
+            return {'stamp': None, 'defaults': {}, 'sections': {}, 'inherited': {}}
+
+        with _parsed_lock:
+            loaded = _parsed.get(key)
+        if loaded and loaded['stamp'] == stamp:
+            return loaded
+
+        try:
+            with self._snapshot_file.open() as f:
+                loaded = json.load(f)
+        except (OSError, ValueError):
+            loaded = None
+        if not loaded or loaded.get('version') != SNAPSHOT_VERSION or loaded.get('stamp') != stamp:
+            # The stamp comes from the open file, the one that is parsed
+            with open(key) as f:
+                stamp = _stamp(os.fstat(f.fileno()))
+                loaded = _parse(f.read(), key, stamp)
+            try:
+                with atomic_write(self._snapshot_file) as f:
+                    json.dump(loaded, f)
+            except OSError:
+                pass
+
+        with _parsed_lock:
+            _parsed[key] = loaded
+        return loaded
+
     def __read(self):
-        self._config.read(self._config_file.resolve())
+        self._loaded = self.__load()
+        # Copies, the loaded configuration is shared by the process
+        self._config = ConfigSections(
+            {k: dict(v) for k, v in self._loaded['sections'].items()}, dict(self._loaded['defaults'])
+        )
 
     @property
     def configfile(self):
@@ -32,8 +267,46 @@ class Configuration():
 
     @config.setter
     def config(self, cfg):
-        self._config = cfg
+        self._config = cfg if isinstance(cfg, ConfigSections) else ConfigSections.from_parser(cfg)
+
+    def profiles(self):
+        """Names of the configured profiles.
+
+        Templates (sections named template:<name>, or declaring `profiles`)
+        and sections without an account role (instance_id and profile_id),
+        such as those other sections only inherit from, are left out.
+        """
+        return [
+            k for k, v in self._config._sections.items()
+            if not k.startswith(TEMPLATE_PREFIX) and PROFILES not in v and PROFILE_KEYS <= v.keys()
+        ]
 
     def save(self):
-        with self._config_file.open('w') as f:
-            self._config.write(f)
+        """Write the sections changed since the configuration was read.
+
+        The file is read again under a lock and rewritten atomically, so
+        that concurrent commands saving other profiles do not undo each other.
+        """
+        loaded = self._loaded
+        sections = self._config._sections
+        changed = [k for k, v in sections.items() if v != loaded['sections'].get(k)]
+        removed = [_ for _ in loaded['sections'] if _ not in sections]
+
+        self.__ensure_config_dir()
+        with FileLock(f'{self._config_file}.lock'):
+            current = _raw_parser()
+            current.read(self._config_file)
+            if self._config.defaults() != loaded['defaults']:
+                current[DEFAULT_SECTION] = self._config.defaults()
+            for name in changed:
+                inherited = loaded['inherited'].get(name, {})
+                current[name] = {k: v for k, v in sections[name].items() if inherited.get(k) != v}
+            for name in removed:
+                current.remove_section(name)
+            _resolve(_expand(_raw_sections(current)[0]))
+            with atomic_write(self._config_file, mode=0o644) as f:
+                current.write(f)
+
+        with _parsed_lock:
+            _parsed.pop(str(self._config_file), None)
+        self._loaded = self.__load()
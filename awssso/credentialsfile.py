@@ -0,0 +1,88 @@
+import os
+import re
+from pathlib import Path
+
+from awssso.filelock import FileLock, atomic_write
+
+SECTION_RX = re.compile(r'^\s*\[([^\]]+)\]\s*$')
+KEY_RX = re.compile(r'^\s*([^=#;\s]+)\s*=')
+
+
+class CredentialsFile():
+    """Native writer for the AWS CLI shared credentials file.
+
+    Replaces `aws configure set`: every profile is updated in one locked,
+    atomic write, and comments or unrelated settings are left untouched.
+    """
+
+    def __init__(self, path=None):
+        path = path or os.environ.get('AWS_SHARED_CREDENTIALS_FILE', '~/.aws/credentials')
+        self._path = Path(path).expanduser()
+
+    @property
+    def path(self):
+        return self._path
+
+    def update(self, profiles):
+        """Set keys of each profile, `profiles` maps profile names to key / value dicts."""
+        self._path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        with FileLock(f'{self._path}.lock'):
+            try:
+                lines = self._path.read_text().splitlines()
+            except FileNotFoundError:
+                lines = []
+            with atomic_write(self._path) as f:
+                f.writelines(f'{_}\n' for _ in CredentialsFile.merge(lines, profiles))
+
+    @staticmethod
+    def merge(lines, profiles):
+        output = []
+        pending = {}
+        section = None
+
+        def flush():
+            # Missing keys go right after the last non-blank line of the section
+            if pending:
+                index = len(output)
+                while index > 0 and not output[index - 1].strip():
+                    index -= 1
+                output[index:index] = [f'{k} = {v}' for k, v in pending.items()]
+                pending.clear()
+
+        remaining = dict(profiles)
+        for line in lines:
+            match = SECTION_RX.match(line)
+            if match:
+                flush()
+                section = match.group(1).strip()
+                if section in remaining:
+                    pending.update(remaining.pop(section))
+                output.append(line)
+                continue
+
+            match = KEY_RX.match(line)
+            if match and section in profiles and match.group(1) in profiles[section]:
+                key = match.group(1)
+                output.append(f'{key} = {profiles[section][key]}')
+                pending.pop(key, None)
+                continue
+
+            output.append(line)
+        flush()
+
+        for section, values in remaining.items():
+            if output and output[-1].strip():
+                output.append('')
+            output.append(f'[{section}]')
+            output.extend(f'{k} = {v}' for k, v in values.items())
+
+        return output
+
+
+def write_env_files(directory, profiles):
+    """Write a dotenv file per profile in `directory`, `profiles` maps profile names to key / value dicts."""
+    directory = Path(directory).expanduser()
+    directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+    for profile, env in profiles.items():
+        with atomic_write(directory / f'{profile}.env') as f:
+            f.writelines(f'{k}={v}\n' for k, v in env.items())
@@ -0,0 +1,109 @@
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+from time import sleep, time
+
+from awssso.broker import CredentialsBroker
+from awssso.broker import Error as BrokerError
+from awssso.client import socket_path
+from awssso.saml import BotoClientError
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.server.touch()
+        try:
+            request = json.loads(self.rfile.readline())
+            credentials = self.server.broker.get(
+                request['profile'], request.get('duration'), request.get('renew', False)
+            )
+            response = {'credentials': credentials.to_json()}
+        except BotoClientError as e:
+            response = {'error': f'{e} (request id: {e.request_id})'}
+        except (BrokerError, KeyError, ValueError) as e:
+            response = {'error': str(e)}
+        except Exception as e:
+            response = {'error': f'{type(e).__name__}: {e}'}
+        self.wfile.write(json.dumps(response).encode() + b'\n')
+        self.server.touch()
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, idle_timeout, pool=None):
+        self.broker = CredentialsBroker(pool)
+        self.idle_timeout = idle_timeout
+        self._last_activity = time()
+        socketserver.UnixStreamServer.__init__(self, path, RequestHandler)
+
+    def server_bind(self):
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(umask)
+
+    def touch(self):
+        self._last_activity = time()
+
+    @property
+    def idle(self):
+        return time() - self._last_activity > self.idle_timeout
+
+    def watch_idle(self, interval=1):
+        while True:
+            sleep(interval)
+            if self.idle:
+                self.shutdown()
+                break
+
+
+def is_running(path):
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        s.close()
+
+
+def serve(path=None, idle_timeout=900, refresh_ahead=0, browser_pool=0, browser_idle_timeout=600):
+    path = path or socket_path()
+    if is_running(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+    pool = None
+    if browser_pool:
+        from awssso.ssodriver import DriverPool
+
+        pool = DriverPool(browser_pool, idle_timeout=browser_idle_timeout)
+        threading.Thread(target=pool.watch, daemon=True).start()
+
+    server = DaemonServer(path, idle_timeout, pool)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        if idle_timeout:
+            threading.Thread(target=server.watch_idle, daemon=True).start()
+        if refresh_ahead:
+            threading.Thread(target=server.broker.refresh_ahead, args=(refresh_ahead, ), daemon=True).start()
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if pool:
+            pool.close()
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,157 @@
+import fcntl
+import os
+import tempfile
+from contextlib import contextmanager
+from time import sleep, time
+
+
+class Error(Exception):
+    """Base class for FileLock exceptions."""
+
+    def __init__(self, msg=''):
+        self.message = msg
+        Exception.__init__(self, msg)
+
+    def __repr__(self):
+        return self.message
+
+    __str__ = __repr__
+
+
+class LockTimeout(Error):
+    """Raised when a lock could not be acquired in time."""
+    pass
+
+
+class FileLock():
+    """Exclusive advisory lock (flock) on `path`, shared between processes.
+
+    The holder writes its pid and the time it got the lock into the file.
+    With `stale` set, a waiter breaks a lock held for longer than `stale`
+    seconds (a hung holder) by replacing the file. Locks of processes that
+    died are released by the kernel.
+    """
+
+    def __init__(self, path, timeout=30, poll_interval=0.05, stale=None):
+        self._path = str(path)
+        self._timeout = timeout
+        self._poll_interval = poll_interval
+        self._stale = stale
+        self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def locked(self):
+        return self._fd is not None
+
+    def owner(self):
+        """Return (pid, acquired time) of the holder as written in the lock file, or None."""
+        try:
+            with open(self._path) as f:
+                pid, acquired = f.read().split()
+            return int(pid), float(acquired)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def is_stale(self):
+        owner = self.owner()
+        if self._stale is None or owner is None:
+            return False
+        return time() - owner[1] > self._stale
+
+    def _break(self, ino):
+        """Remove the lock file `ino` of a hung holder.
+
+        Waiters break locks one at a time, under a lock on a second file that
+        is never removed, and only if the lock file is still the stale one:
+        two waiters seeing the same stale lock must not remove the new lock
+        the first of them took. The holder keeps its lock on the unlinked
+        file, new comers lock a new one.
+        """
+        fd = os.open(f'{self._path}.break', os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.stat(self._path).st_ino == ino and self.is_stale():
+                os.unlink(self._path)
+        except FileNotFoundError:
+            pass
+        finally:
+            os.close(fd)
+
+    def _try_lock(self, fd):
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        try:
+            # The file may have been replaced by a waiter breaking a stale lock
+            if os.fstat(fd).st_ino != os.stat(self._path).st_ino:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                return False
+        except FileNotFoundError:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            return False
+        return True
+
+    def acquire(self):
+        deadline = time() + self._timeout
+        while True:
+            fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o600)
+            if self._try_lock(fd):
+                os.ftruncate(fd, 0)
+                os.write(fd, f'{os.getpid()} {time()}'.encode())
+                self._fd = fd
+                return
+            ino = os.fstat(fd).st_ino
+            os.close(fd)
+            if self.is_stale():
+                self._break(ino)
+                continue
+            if time() > deadline:
+                raise LockTimeout(f'timed out waiting for lock {self._path}')
+            sleep(self._poll_interval)
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+@contextmanager
+def atomic_write(path, mode=0o600):
+    """Write `path` through a temporary file renamed over it on success.
+
+    Readers either see the previous content or the new one, never a partial
+    write. Permissions of an existing file are kept.
+    """
+    path = str(path)
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        pass
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=f'.{os.path.basename(path)}.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
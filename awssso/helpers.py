@@ -1,12 +1,37 @@
 import json
+import os
+import random
 import re
 import subprocess
+import sys
+import threading
+from contextlib import contextmanager
 from datetime import date, datetime, timezone
-from urllib.parse import urlparse
+from hashlib import sha256
+from pathlib import Path
+from time import time
+from urllib.parse import urlencode, urlparse
 
-import keyring
-import requests
-from inquirer.errors import ValidationError
+from awssso.timings import span, timed
+
+# Single flight locks: how long to wait for another process refreshing the
+# same token or credentials, and after how long its lock is considered stale.
+# A token refresh may wait for a MFA code to be typed in.
+TOKEN_LOCK_TIMEOUT = 300
+TOKEN_LOCK_STALE = 600
+CREDENTIALS_LOCK_TIMEOUT = 60
+CREDENTIALS_LOCK_STALE = 120
+
+# SAML assertions are reused until this many seconds before their NotOnOrAfter
+SAML_MARGIN = 30
+
+# Federation sign in tokens are valid for 15 minutes, they are reused until
+# a minute before that.
+SIGNIN_TOKEN_TTL = 900
+SIGNIN_TOKEN_MARGIN = 60
+
+# Role session duration STS uses when none is requested
+DEFAULT_SESSION_DURATION = 3600
 
 SPINNER_MSGS = {
     'token_refresh': 'Refreshing token',
@@ -14,44 +39,284 @@ SPINNER_MSGS = {
 }
 
 
+# keyring backends are not guaranteed to be thread safe
+_keyring_lock = threading.Lock()
+
+
+class KeyringStorage():
+    """One keyring entry per secret."""
+
+    def __init__(self, service_name, username):
+        self._service_name = service_name
+        self._username = username
+
+    def get(self, stype):
+        import keyring
+
+        with _keyring_lock:
+            return keyring.get_password(f'{self._service_name}.{stype}', self._username)
+
+    def set(self, stype, password):
+        import keyring
+
+        with _keyring_lock:
+            return keyring.set_password(f'{self._service_name}.{stype}', self._username, password)
+
+    def flush(self):
+        pass
+
+    def reload(self):
+        pass
+
+
+class KeyringBundleStorage():
+    """All secrets of a username / url in a single keyring entry.
+
+    The bundle is read once and written back in one call per batch of
+    changes. Secrets missing from it are looked up in the per-secret layout
+    of KeyringStorage and migrated into the bundle.
+    """
+
+    def __init__(self, service_name, username):
+        self._service_name = service_name
+        self._username = username
+        self._legacy = KeyringStorage(service_name, username)
+        self._lock = threading.Lock()
+        self._bundle = None
+        self._dirty = set()
+        self._missing = set()
+
+    def _read(self):
+        import keyring
+
+        with _keyring_lock:
+            bundle = keyring.get_password(self._service_name, self._username)
+        return json.loads(bundle) if bundle else None
+
+    def _load(self):
+        if self._bundle is None:
+            self._bundle = self._read() or {}
+
+    def get(self, stype):
+        with self._lock:
+            self._load()
+            if stype not in self._bundle and stype not in self._missing:
+                value = self._legacy.get(stype)
+                if value is None:
+                    self._missing.add(stype)
+                else:
+                    self._bundle[stype] = value
+                    self._dirty.add(stype)
+            return self._bundle.get(stype)
+
+    def set(self, stype, password):
+        with self._lock:
+            self._load()
+            self._bundle[stype] = password
+            self._dirty.add(stype)
+            self._missing.discard(stype)
+
+    def flush(self):
+        import keyring
+
+        with self._lock:
+            if not self._dirty:
+                return
+            # Merge with changes other processes may have written meanwhile
+            bundle = self._read() or {}
+            bundle.update({_: self._bundle[_] for _ in self._dirty})
+            with _keyring_lock:
+                keyring.set_password(self._service_name, self._username, json.dumps(bundle))
+            self._bundle = bundle
+            self._dirty.clear()
+
+    def reload(self):
+        with self._lock:
+            if not self._dirty:
+                self._bundle = None
+                self._missing.clear()
+
+
 class SecretsManager():
-    def __init__(self, username, url):
+    STORAGES = {
+        'keyring': KeyringStorage,
+        'bundle': KeyringBundleStorage
+    }
+
+    def __init__(self, username, url, storage='keyring', cache=None):
         self._username = username
         self._base_service_name = f'awssso.{urlparse(url).netloc}'
+        self._storage = SecretsManager.STORAGES[storage](self._base_service_name, username)
+        self._cache = cache
+        # Batches nest and may be opened by several threads sharing the manager
+        self._batch = 0
+        self._batch_lock = threading.Lock()
+
+    @classmethod
+    def from_params(cls, params, cache_dir=None):
+        cache = None
+        cache_name = os.environ.get('AWSSSO_CREDENTIALS_CACHE') or params.get('credentials_cache', 'keyring')
+        if cache_name != 'keyring':
+            from awssso.cache import get_cache
+            from awssso.config import Configuration
+
+            cache = get_cache(cache_name, cache_dir or Configuration().configdir)
+        return cls(params.get('username'), params.get('url'), params.get('secrets_storage', 'keyring'), cache)
 
     def get(self, stype, default=None):
-        return keyring.get_password(
-            f'{self._base_service_name}.{stype}',
-            self._username
-        ) or default
+        with span('secrets.get', key=stype):
+            return self._storage.get(stype) or default
 
     def set(self, stype, password):
-        return keyring.set_password(
-            f'{self._base_service_name}.{stype}',
-            self._username,
-            password
-        )
+        with span('secrets.set', key=stype):
+            result = self._storage.set(stype, password)
+            with self._batch_lock:
+                batching = self._batch > 0
+            if not batching:
+                self._storage.flush()
+            return result
+
+    @contextmanager
+    def batch(self):
+        """Write the secrets set within the block at once."""
+        with self._batch_lock:
+            self._batch += 1
+        try:
+            yield self
+        finally:
+            with self._batch_lock:
+                self._batch -= 1
+                batching = self._batch > 0
+            if not batching:
+                with span('secrets.flush'):
+                    self._storage.flush()
+
+    def reload(self):
+        """Forget secrets loaded so far, to see changes from other processes."""
+        self._storage.reload()
+
+    def _cache_key(self, key):
+        # Credentials caches are shared by every portal user of a config dir,
+        # unlike keyring entries which already belong to one username / url
+        return f'{self._base_service_name}.{self._username}.{key}'
+
+    def get_cached(self, key):
+        """Return a cached value from the credentials cache, or the keyring without one."""
+        if self._cache is None:
+            return self.get(key)
+        with span('cache.get', key=key):
+            return self._cache.get(self._cache_key(key))
+
+    def set_cached(self, key, value, expires):
+        """Cache `value` until `expires` (epoch)."""
+        self.set_cached_many([(key, value, expires)])
+
+    def _transient_cache(self):
+        if self._cache is not None:
+            return self._cache
+        from awssso.cache import get_cache
+
+        return get_cache('memory', None)
+
+    def get_transient(self, key):
+        """Return a value stored with set_transient, unless it has expired."""
+        with span('cache.get', key=key):
+            return self._transient_cache().get(self._cache_key(key))
+
+    def set_transient(self, key, value, expires):
+        """Keep `value` until `expires` (epoch) in the credentials cache.
+
+        Without one (keyring), it is kept in process memory only: keyring
+        entries never expire, and large values may not fit in them.
+        """
+        with span('cache.set', entries=1):
+            self._transient_cache().set(self._cache_key(key), value, expires)
+
+    def set_cached_many(self, items):
+        """Cache (key, value, expires) items in one write."""
+        if self._cache is None:
+            with self.batch():
+                for key, value, _ in items:
+                    self.set(key, value)
+        else:
+            with span('cache.set', entries=len(items)):
+                self._cache.set_many([(self._cache_key(key), value, expires) for key, value, expires in items])
+
+
+_signin_tokens = {}
+_signin_tokens_lock = threading.Lock()
 
 
 class CredentialsHelper():
-    def __init__(self, credentials):
-        self.credentials = credentials
-
-    @property
-    def credentials(self):
-        return self._credentials
-
-    @property
-    def access_key_id(self):
-        return self.credentials['AccessKeyId']
+    """Immutable AWS credentials of a role session.
+
+    The expiration is kept as epoch seconds (`expires`), so that checking
+    it or loading the record from the cache (see `encode`) parses no date.
+    `issued` is when the credentials were received from STS, 0 if unknown.
+    """
+
+    __slots__ = ('access_key_id', 'secret_access_key', 'session_token', 'expires', 'issued')
+
+    # Version of the cache encoding, its first field
+    CACHE_VERSION = '3'
+    # Former versions still read, by number of fields
+    CACHE_VERSIONS = {'2': 5, '3': 6}
+
+    def __init__(self, credentials, issued=None):
+        expiration = credentials['Expiration']
+        if isinstance(expiration, str):
+            expiration = datetime.fromisoformat(expiration)
+        self._init(
+            credentials['AccessKeyId'], credentials['SecretAccessKey'], credentials['SessionToken'], expiration.timestamp(),
+            time() if issued is None else issued
+        )
 
-    @property
-    def secret_access_key(self):
-        return self.credentials['SecretAccessKey']
+    def _init(self, access_key_id, secret_access_key, session_token, expires, issued=0):
+        object.__setattr__(self, 'access_key_id', access_key_id)
+        object.__setattr__(self, 'secret_access_key', secret_access_key)
+        object.__setattr__(self, 'session_token', session_token)
+        object.__setattr__(self, 'expires', float(expires))
+        object.__setattr__(self, 'issued', float(issued))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def _fields(self):
+        return (self.access_key_id, self.secret_access_key, self.session_token, self.expires)
+
+    def __eq__(self, other):
+        return isinstance(other, CredentialsHelper) and self._fields() == other._fields()
+
+    def __hash__(self):
+        return hash(self._fields())
+
+    def encode(self):
+        """Compact cache encoding, read back by `decode`."""
+        # Keys, tokens (base64) and the epoch never contain a |
+        return '|'.join([
+            CredentialsHelper.CACHE_VERSION, self.access_key_id, self.secret_access_key, self.session_token, repr(self.expires), repr(self.issued)
+        ])
+
+    @classmethod
+    def decode(cls, value):
+        """Load credentials cached by `encode`, or in the former JSON object format; None for an unknown version."""
+        if value.startswith('{'):
+            return cls(json.loads(value), issued=0)
+        fields = value.split('|')
+        if cls.CACHE_VERSIONS.get(fields[0]) != len(fields):
+            return None
+        credentials = cls.__new__(cls)
+        credentials._init(*fields[1:])
+        return credentials
 
     @property
-    def session_token(self):
-        return self.credentials['SessionToken']
+    def credentials(self):
+        return {
+            'AccessKeyId': self.access_key_id,
+            'SecretAccessKey': self.secret_access_key,
+            'SessionToken': self.session_token,
+            'Expiration': self.expiration
+        }
 
     @property
     def json(self):
@@ -81,23 +346,22 @@ class CredentialsHelper():
             'sessionToken': self.session_token
         }
 
-    @credentials.setter
-    def credentials(self, credentials):
-        if isinstance(credentials['Expiration'], str):
-            credentials['Expiration'] = datetime.fromisoformat(credentials['Expiration'])
-        self._credentials = credentials
-
     @property
     def expiration(self):
-        return self.credentials['Expiration']
+        return datetime.fromtimestamp(self.expires, timezone.utc)
 
     @property
     def duration(self):
-        return int((self.expiration - datetime.now(timezone.utc)).total_seconds())
+        return int(self.expires - time())
 
     @property
     def expired(self):
-        return self.expiration < datetime.now(timezone.utc)
+        return self.expires < time()
+
+    @property
+    def lifetime(self):
+        """Seconds the credentials were issued for, None if unknown."""
+        return round(self.expires - self.issued) if self.issued else None
 
     def to_cli_cmds(self, profile):
         cmds = []
@@ -109,35 +373,274 @@ class CredentialsHelper():
             ])
         return cmds
 
+    @property
+    def process(self):
+        """Credentials in the credential_process output format."""
+        return {
+            **self.credentials,
+            'Version': 1
+        }
+
+    @property
+    def container(self):
+        """Credentials in the container credentials provider format (AWS_CONTAINER_CREDENTIALS_FULL_URI)."""
+        return {
+            'AccessKeyId': self.access_key_id,
+            'SecretAccessKey': self.secret_access_key,
+            'Token': self.session_token,
+            'Expiration': self.expiration.strftime('%Y-%m-%dT%H:%M:%SZ')
+        }
+
     def to_exports(self):
         return [f'export {key}={value}' for key, value in self.env.items()]
 
     def to_json(self):
-        return json.dumps({
-            **self.credentials,
-            'Version': 1
-        }, default=json_serial)
+        return json.dumps(self.process, default=json_serial)
+
+    def signin_token(self, duration=None, transport=None, cache=None):
+        """Return a federation sign in token for these credentials, reused while it is valid.
+
+        Tokens are kept in memory for the process, and with `cache` (a
+        SecretsManager) in its credentials cache for the next ones.
+        """
+        from awssso.transport import get_transport
+
+        key = signin_cache_key(self.access_key_id, duration)
+        with _signin_tokens_lock:
+            token, expires = _signin_tokens.get(key, (None, 0))
+        if expires > time():
+            return token
+
+        cached = cache.get_transient(key) if cache else None
+        if cached:
+            token, expires = json.loads(cached)
+        if expires <= time():
+            transport = transport or get_transport()
+            params = {
+                'Action': 'getSigninToken',
+                'Session': json.dumps(self.console),
+                'SessionDuration': duration or self.duration
+            }
+            with span('federation.signin_token'):
+                response = transport.get(transport.federation_url(), params=params)
+            token = response.json()['SigninToken']
+            expires = time() + SIGNIN_TOKEN_TTL - SIGNIN_TOKEN_MARGIN
+            if cache:
+                cache.set_transient(key, json.dumps([token, expires]), expires)
+
+        with _signin_tokens_lock:
+            _signin_tokens[key] = (token, expires)
+        return token
 
-    def to_console_url(self, duration=None):
-        duration = duration or self.duration
+    def to_console_url(self, duration=None, transport=None, cache=None):
+        from awssso.transport import get_transport
+
+        transport = transport or get_transport()
         params = {
-            'Action': 'getSigninToken',
-            'Session': json.dumps(self.console),
-            'SessionDuration': duration
+            'Action': 'login',
+            'Destination': 'https://console.aws.amazon.com/',
+            'SigninToken': self.signin_token(duration, transport, cache)
         }
-        response = requests.get('https://signin.aws.amazon.com/federation', params=params)
-
-        login_request = requests.Request(
-            'GET',
-            'https://signin.aws.amazon.com/federation',
-            params={
-                'Action': 'login',
-                'Destination': 'https://console.aws.amazon.com/',
-                'SigninToken': response.json()['SigninToken']
-            }
-        ).prepare()
-
-        return login_request.url
+        return f'{transport.federation_url()}?{urlencode(params)}'
+
+
+@contextmanager
+def single_flight(lock_dir, name, timeout, stale):
+    """Run the block in one process at a time for `name`, other processes wait for it.
+
+    Yields whether the lock was acquired: when it times out, the caller goes
+    on without it rather than failing. Without `lock_dir` nothing is locked.
+    """
+    if lock_dir is None:
+        yield False
+        return
+
+    from awssso.filelock import FileLock, LockTimeout
+
+    path = Path(lock_dir) / 'locks'
+    path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    lock = FileLock(path / f'{name}.lock', timeout=timeout, stale=stale)
+    try:
+        with span('lock.wait', lock=name):
+            lock.acquire()
+    except LockTimeout:
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        lock.release()
+
+
+def token_lock_name(url, username):
+    return f'token.{sha256(f"{username}@{url}".encode()).hexdigest()[:16]}'
+
+
+def credentials_cache_key(instance_id, profile_id, role_arn=None):
+    if role_arn:
+        return f'{instance_id}.{profile_id}.{role_arn}.credentials'
+    return f'{instance_id}.{profile_id}.credentials'
+
+
+def signin_cache_key(access_key_id, duration=None):
+    return f'{access_key_id}.{duration or "default"}.signin'
+
+
+def saml_cache_key(instance_id, profile_id):
+    return f'{instance_id}.{profile_id}.saml'
+
+
+def get_saml(secrets, sso_factory, instance_id, profile_id, transport=None, refresh=False):
+    """Return (SAMLHelper, reused) for a profile, reusing its last assertion until it expires.
+
+    Assertions are kept until their NotOnOrAfter, less SAML_MARGIN seconds,
+    so that renewals with another duration, other roles or retries skip the
+    portal; see SecretsManager.set_transient for where.
+    """
+    from awssso.saml import SAMLHelper
+
+    key = saml_cache_key(instance_id, profile_id)
+    with span('saml') as s:
+        payload = None if refresh else secrets.get_transient(key)
+        if payload:
+            saml = SAMLHelper(payload, transport)
+            if saml.not_on_or_after and saml.not_on_or_after.timestamp() - SAML_MARGIN > time():
+                s.set('reused', True)
+                return saml, True
+
+        sso = sso_factory()
+        saml = SAMLHelper(sso.get_saml_payload(instance_id, profile_id), sso.transport)
+        if saml.not_on_or_after:
+            secrets.set_transient(key, saml.payload, saml.not_on_or_after.timestamp() - SAML_MARGIN)
+        s.set('reused', False)
+        return saml, False
+
+
+@timed('credentials')
+def get_or_assume_credentials(secrets, sso_factory, instance_id, profile_id, duration=None, renew=False, lock_dir=None, role_arn=None, transport=None):
+    """Return cached credentials for a profile, assuming its role when needed.
+
+    `sso_factory` is only called when the cache cannot be used, so callers
+    can defer getting an authn token until a renewal actually happens.
+    With `lock_dir`, only one process at a time assumes the role of a
+    profile, the others use the credentials it cached. `role_arn` picks a
+    role of the SAML assertion other than the first one.
+    """
+    cache_key = credentials_cache_key(instance_id, profile_id, role_arn)
+    cached_credentials = secrets.get_cached(cache_key)
+    credentials = CredentialsHelper.decode(cached_credentials) if cached_credentials else None
+
+    if not credentials or credentials.expired or renew:
+        with single_flight(lock_dir, f'credentials.{cache_key}', CREDENTIALS_LOCK_TIMEOUT, CREDENTIALS_LOCK_STALE):
+            # Another process may have renewed them while we waited
+            secrets.reload()
+            latest = secrets.get_cached(cache_key)
+            if latest and latest != cached_credentials:
+                credentials = CredentialsHelper.decode(latest)
+                if credentials and not credentials.expired:
+                    return credentials
+
+            from awssso.saml import BotoClientError
+
+            saml, reused = get_saml(secrets, sso_factory, instance_id, profile_id, transport)
+            try:
+                response = saml.assume_role(duration, role_arn)
+            except BotoClientError:
+                if not reused:
+                    raise
+                # STS may refuse an assertion it already saw, or consider it
+                # expired or invalid: get a new one
+                saml, _ = get_saml(secrets, sso_factory, instance_id, profile_id, transport, refresh=True)
+                response = saml.assume_role(duration, role_arn)
+            credentials = CredentialsHelper(response['Credentials'])
+            secrets.set_cached(cache_key, credentials.encode(), credentials.expires)
+
+    return credentials
+
+
+@timed('roles')
+def get_or_assume_roles(secrets, sso_factory, instance_id, profile_id, role_arns=None, duration=None, renew=False, lock_dir=None, workers=8, transport=None):
+    """Return credentials of several roles of a profile (all of its SAML assertion by default).
+
+    Roles missing from the cache are assumed concurrently from a single SAML
+    assertion and cached in one write. Returns a dict of role arn to
+    bulk.Result, whose value is a CredentialsHelper.
+    """
+    from awssso.bulk import Result
+
+    def from_cache(arns):
+        found = {}
+        for arn in arns:
+            value = secrets.get_cached(credentials_cache_key(instance_id, profile_id, arn))
+            credentials = CredentialsHelper.decode(value) if value else None
+            if credentials and not credentials.expired:
+                found[arn] = Result(arn, credentials)
+        return found
+
+    results = from_cache(role_arns) if role_arns and not renew else {}
+    if role_arns and len(results) == len(role_arns):
+        return results
+
+    with single_flight(lock_dir, f'credentials.{credentials_cache_key(instance_id, profile_id)}', CREDENTIALS_LOCK_TIMEOUT, CREDENTIALS_LOCK_STALE):
+        saml, reused = get_saml(secrets, sso_factory, instance_id, profile_id, transport)
+        role_arns = role_arns or saml.role_arns
+        if not renew:
+            # Another process may have cached some of them while we waited
+            secrets.reload()
+            results = from_cache(role_arns)
+
+        items = []
+
+        def assume(saml, arns):
+            for result in saml.assume_roles(arns, duration, workers):
+                if result.ok:
+                    result.value = CredentialsHelper(result.value['Credentials'])
+                    key = credentials_cache_key(instance_id, profile_id, result.profile)
+                    items.append((key, result.value.encode(), result.value.expires))
+                results[result.profile] = result
+
+        missing = [_ for _ in role_arns if _ not in results]
+        if missing:
+            assume(saml, missing)
+
+        failed = [_ for _ in missing if not results[_].ok]
+        if reused and failed:
+            # Failures may come from the reused assertion, try them once with a new one
+            saml, _ = get_saml(secrets, sso_factory, instance_id, profile_id, transport, refresh=True)
+            assume(saml, failed)
+        if items:
+            secrets.set_cached_many(items)
+
+    return results
+
+
+def refresh_due(expiration, window, jitter=0.25):
+    """Tell whether `expiration` (epoch) falls within `window` seconds from now.
+
+    The window is randomly shortened by up to `jitter` so that many profiles
+    expiring together do not all refresh at the same moment.
+    """
+    if not window:
+        return False
+    return expiration - time() < window * (1 - random.uniform(0, jitter))
+
+
+def refresh_window(window, lifetime=None):
+    """Cap a refresh ahead `window` at half the `lifetime` of the credentials (default: 1 hour, as STS).
+
+    With a window as long as the session, credentials would be due again
+    right after being renewed, and renewed on each call.
+    """
+    return min(window, (lifetime or DEFAULT_SESSION_DURATION) // 2)
+
+
+def spawn_refresh(profile, region, force_refresh=False):
+    """Renew the cached credentials of `profile` from a detached `awssso login` process."""
+    cmd = [sys.executable, '-m', 'awssso', '--no-spinner', '--region', region, 'login', '-p', profile, '--cache-only', '-r']
+    if force_refresh:
+        cmd.append('-f')
+    with open(os.devnull, 'r+b') as devnull:
+        subprocess.Popen(cmd, stdin=devnull, stdout=devnull, stderr=devnull, start_new_session=True, close_fds=True)
 
 
 def config_override(config, section, args, keep=['url', 'region', 'username', 'aws_profile']):
@@ -153,6 +656,8 @@ def config_override(config, section, args, keep=['url', 'region', 'username', 'a
 
 
 def validate_url(answers, url):
+    from inquirer.errors import ValidationError
+
     rx = r'^https://[\S-]+\.awsapps\.com/start/$'
     if re.match(rx, url) is None:
         raise ValidationError('', reason=f'URL must match {rx}')
@@ -160,6 +665,8 @@ def validate_url(answers, url):
 
 
 def validate_empty(answers, s):
+    from inquirer.errors import ValidationError
+
     if not s:
         raise ValidationError('', reason='Must not be empty')
     return True
@@ -1,8 +1,10 @@
+import re
 import xml.etree.ElementTree as ET
 from base64 import b64decode
+from codecs import BOM_UTF8
+from datetime import datetime, timezone
 
-import boto3
-from botocore.exceptions import ClientError
+from awssso.timings import span
 
 
 class Error(Exception):
@@ -33,49 +35,232 @@ class AssumeRoleValidationError(BotoClientError):
     pass
 
 
-class SAMLHelper():
-    NS = {
-        'a': 'urn:oasis:names:tc:SAML:2.0:assertion'
-    }
+class RoleNotFound(Error):
+    """Raised when a role is not granted by the SAML assertion."""
+    pass
+
+
+class UnsafeAssertion(Error):
+    """Raised when a SAML assertion is too large, declares a DTD or is not UTF-8."""
+    pass
+
+
+SAML_NS = 'urn:oasis:names:tc:SAML:2.0:assertion'
+ASSERTION = f'{{{SAML_NS}}}Assertion'
+ATTRIBUTE = f'{{{SAML_NS}}}Attribute'
+ATTRIBUTE_VALUE = f'{{{SAML_NS}}}AttributeValue'
+ATTRIBUTE_STATEMENT = f'{{{SAML_NS}}}AttributeStatement'
+CONDITIONS = f'{{{SAML_NS}}}Conditions'
+SUBJECT = f'{{{SAML_NS}}}Subject'
+SUBJECT_CONFIRMATION = f'{{{SAML_NS}}}SubjectConfirmation'
+SUBJECT_CONFIRMATION_DATA = f'{{{SAML_NS}}}SubjectConfirmationData'
+
+# Paths from the Assertion element
+ATTRIBUTES_PATH = f'{ATTRIBUTE_STATEMENT}/{ATTRIBUTE}'
+SUBJECT_CONFIRMATION_DATA_PATH = f'{SUBJECT}/{SUBJECT_CONFIRMATION}/{SUBJECT_CONFIRMATION_DATA}'
+
+# Attributes read from the assertion, by name
+ATTRIBUTES = {
+    'https://aws.amazon.com/SAML/Attributes/Role': 'roles',
+    'https://aws.amazon.com/SAML/Attributes/SessionDuration': 'duration',
+    'https://aws.amazon.com/SAML/Attributes/RoleSessionName': 'session_name'
+}
+
+DEFAULT_DURATION = 3600
+MAX_ASSERTION_SIZE = 4 * 1024 * 1024
+
+# The DTD check reads the raw bytes, which only works for ASCII compatible encodings
+SAFE_ENCODINGS = ('utf-8', 'utf8', 'us-ascii', 'ascii')
+XML_ENCODING = re.compile(rb'<\?xml[^>]*?encoding\s*=\s*["\']([^"\']*)["\']')
+
+INSTANT = re.compile(r'(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.(\d+))?(Z|[+-]\d{2}:?\d{2})?')
+
+
+class Assertion():
+    def __init__(self):
+        self.roles = []
+        self.duration = DEFAULT_DURATION
+        self.session_name = None
+        self.not_on_or_after = None
+
+
+def parse_instant(value):
+    """Parse a SAML (xs:dateTime) instant such as 2019-09-30T12:00:00.123Z into a UTC datetime.
+
+    Instants with an explicit offset (+02:00) are converted, those without
+    any are taken as UTC.
+    """
+    m = INSTANT.fullmatch(value.strip())
+    if m is None:
+        raise ValueError(f'invalid SAML instant: {value}')
+    date, fraction, offset = m.groups()
+    offset = '+00:00' if offset in (None, 'Z') else f'{offset[:3]}:{offset[-2:]}'
+    # fromisoformat only takes 3 or 6 digits fractions before Python 3.11
+    instant = datetime.fromisoformat(f'{date}.{(fraction or "")[:6].ljust(6, "0")}{offset}')
+    return instant.astimezone(timezone.utc)
+
+
+def _check_encoding(head):
+    """Refuse documents in encodings where markup is not plain ASCII bytes (UTF-16, UTF-32...)."""
+    if head.startswith(BOM_UTF8):
+        head = head[len(BOM_UTF8):]
+    if b'\x00' in head[:4] or head[:2] in (b'\xff\xfe', b'\xfe\xff'):
+        raise UnsafeAssertion('SAML assertion not encoded in UTF-8 refused')
+    m = XML_ENCODING.match(head)
+    if m and m.group(1).decode('ascii', 'replace').lower() not in SAFE_ENCODINGS:
+        raise UnsafeAssertion(f'SAML assertion encoded in {m.group(1).decode("ascii", "replace")} refused')
+
+
+def _decode(encoded_payload):
+    # Line breaks some portals wrap the payload with are skipped by b64decode
+    if len(encoded_payload) * 3 // 4 > MAX_ASSERTION_SIZE:
+        raise UnsafeAssertion(f'SAML assertion is larger than {MAX_ASSERTION_SIZE} bytes')
+    return b64decode(encoded_payload)
+
+
+def _role(value):
+    # Either order is allowed: "role,principal" or "principal,role"
+    role, _, principal = value.partition(',')
+    role, principal = role.strip(), principal.strip()
+    return (principal, role) if ':saml-provider/' in role else (role, principal)
+
+
+def parse_assertion(encoded_payload):
+    """Extract roles, SessionDuration, RoleSessionName and NotOnOrAfter of a base64 SAML response.
+
+    Documents with a DTD, or not encoded in UTF-8 (where a DTD could not be
+    spotted), are refused before parsing, so that entity expansion payloads
+    never reach the parser.
+    """
+    document = _decode(encoded_payload)
+    _check_encoding(document[:64])
+    if b'<!DOCTYPE' in document or b'<!ENTITY' in document:
+        raise UnsafeAssertion('SAML assertion with a DTD refused')
 
-    XPATH = {
-        'roles': ".//a:Assertion/a:AttributeStatement/a:Attribute[@Name='https://aws.amazon.com/SAML/Attributes/Role']/a:AttributeValue",
-        'duration': ".//a:Assertion/a:AttributeStatement/a:Attribute[@Name='https://aws.amazon.com/SAML/Attributes/SessionDuration']/a:AttributeValue"
-    }
+    root = ET.fromstring(document)
+    element = root if root.tag == ASSERTION else root.find(f'.//{ASSERTION}')
+    assertion = Assertion()
+    if element is None:
+        return assertion
 
-    def __init__(self, encoded_payload):
+    for e in element.iterfind(ATTRIBUTES_PATH):
+        attribute = ATTRIBUTES.get(e.get('Name'))
+        if attribute is None:
+            continue
+        values = [_.text for _ in e.findall(ATTRIBUTE_VALUE) if _.text]
+        if attribute == 'roles':
+            assertion.roles = list(dict.fromkeys(map(_role, values)))
+        elif attribute == 'duration' and values:
+            assertion.duration = int(values[0])
+        elif attribute == 'session_name' and values:
+            assertion.session_name = values[0].strip()
+
+    conditions = element.find(CONDITIONS)
+    confirmation = element.find(SUBJECT_CONFIRMATION_DATA_PATH)
+    not_on_or_after = (
+        (conditions.get('NotOnOrAfter') if conditions is not None else None) or
+        (confirmation.get('NotOnOrAfter') if confirmation is not None else None)
+    )
+    if not_on_or_after:
+        assertion.not_on_or_after = parse_instant(not_on_or_after)
+    return assertion
+
+
+class SAMLHelper():
+    def __init__(self, encoded_payload, transport=None, region=None):
         # Calling AssumeRoleWithSAML does not require the use of AWS security credentials.
         # The identity of the caller is validated by using keys in the metadata document that is uploaded for the SAML provider entity for your identity provider.
         # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/sts.html#STS.Client.assume_role_with_saml
-        self._sts = boto3.client('sts', aws_access_key_id='', aws_secret_access_key='', aws_session_token='')
-        self._root = ET.fromstring(b64decode(encoded_payload))
-        self._role_arn, self._principal_arn = self._get_roles()
-        self._duration = self._get_duration()
+        self._transport = transport
+        self._region = region
+        try:
+            with span('saml.parse', size=len(encoded_payload)):
+                self._assertion = parse_assertion(encoded_payload)
+        except (ET.ParseError, ValueError) as e:
+            raise Error(f'invalid SAML assertion: {e}')
+        if not self._assertion.roles:
+            raise RoleNotFound('no role in the SAML assertion')
+        self._roles = self._assertion.roles
+        self._role_arn, self._principal_arn = self._roles[0]
+        self._duration = self._assertion.duration
         self._payload = encoded_payload
 
+    @property
+    def session_name(self):
+        return self._assertion.session_name
+
+    @property
+    def not_on_or_after(self):
+        """Expiration (datetime) of the assertion, None when it does not tell."""
+        return self._assertion.not_on_or_after
+
     @property
     def duration(self):
         return self._duration
 
-    def _get_roles(self):
-        e = self._root.find(SAMLHelper.XPATH['roles'], SAMLHelper.NS)
-        return tuple(e.text.split(','))
+    @property
+    def role_arn(self):
+        return self._role_arn
+
+    @property
+    def principal_arn(self):
+        return self._principal_arn
 
-    def _get_duration(self):
-        e = self._root.find(SAMLHelper.XPATH['duration'], SAMLHelper.NS)
-        return int(e.text)
+    @property
+    def roles(self):
+        """(role arn, principal arn) pairs granted by the assertion, in their order."""
+        return list(self._roles)
 
-    def assume_role(self, duration=None):
+    @property
+    def role_arns(self):
+        return [_[0] for _ in self._roles]
+
+    def role(self, role_arn=None):
+        """Return the (role arn, principal arn) pair of `role_arn`, the first role by default."""
+        if role_arn is None:
+            return self._roles[0]
+        for _ in self._roles:
+            if _[0] == role_arn:
+                return _
+        raise RoleNotFound(f'role {role_arn} is not in the SAML assertion')
+
+    @property
+    def payload(self):
+        return self._payload
+
+    @property
+    def sts(self):
+        from awssso.transport import get_transport
+
+        return (self._transport or get_transport()).sts(self._region)
+
+    def assume_role(self, duration=None, role_arn=None):
+        from botocore.exceptions import ClientError
+
+        role_arn, principal_arn = self.role(role_arn)
         duration = duration or self._duration
         try:
-            return self._sts.assume_role_with_saml(
-                RoleArn=self._role_arn,
-                PrincipalArn=self._principal_arn,
-                SAMLAssertion=self._payload,
-                DurationSeconds=duration
-            )
+            with span('sts.assume_role', role=role_arn.split('/')[-1]):
+                return self.sts.assume_role_with_saml(
+                    RoleArn=role_arn,
+                    PrincipalArn=principal_arn,
+                    SAMLAssertion=self._payload,
+                    DurationSeconds=duration
+                )
         except ClientError as e:
             if e.response['Error']['Code'] == 'ValidationError':
                 raise AssumeRoleValidationError(e.response)
             else:
                 raise BotoClientError(e.response)
+
+    def assume_roles(self, role_arns=None, duration=None, workers=8):
+        """Assume several roles of the assertion (all by default) concurrently.
+
+        Yields a bulk.Result per role, labelled with the role arn, as they complete.
+        """
+        from awssso import bulk
+
+        for role_arn in role_arns or []:
+            self.role(role_arn)
+        jobs = {_: (lambda r=_: self.assume_role(duration, r)) for _ in role_arns or self.role_arns}
+        return bulk.run(jobs, workers)
@@ -0,0 +1,176 @@
+"""Credentials over HTTP for the container credentials provider of AWS SDKs.
+
+    AWS_CONTAINER_CREDENTIALS_FULL_URI=http://127.0.0.1:9911/<profile>
+    AWS_CONTAINER_AUTHORIZATION_TOKEN_FILE=~/.awssso/serve.token
+
+SDKs fetch credentials of the awssso profile named by the url path, without
+starting a process; they are served from the memory of a CredentialsBroker.
+"""
+import hmac
+import http.server
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from secrets import token_urlsafe
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from awssso.broker import CredentialsBroker
+from awssso.broker import Error as BrokerError
+from awssso.broker import ProfileNotFound, TokenExpired
+from awssso.config import Configuration
+from awssso.filelock import atomic_write
+from awssso.saml import BotoClientError
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 9911
+DEFAULT_WORKERS = 16
+DEFAULT_REFRESH_AHEAD = 900
+REQUEST_TIMEOUT = 10
+
+logger = logging.getLogger(__name__)
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    server_version = 'awssso'
+    # A client that does not send its request in time gives its worker back
+    timeout = REQUEST_TIMEOUT
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        profile = unquote(url.path.strip('/'))
+        authorization = self.headers.get('Authorization', '')
+        if authorization.startswith('Bearer '):
+            authorization = authorization[len('Bearer '):]
+        if not hmac.compare_digest(authorization.encode(), self.server.token.encode()):
+            return self.error(401, 'Unauthorized', 'missing or invalid Authorization header')
+        if not self.server.serves(profile):
+            return self.error(404, 'ProfileNotFound', f'profile {profile} is not served')
+
+        try:
+            query = parse_qs(url.query)
+            duration = int(query['duration'][0]) if 'duration' in query else None
+        except ValueError:
+            return self.error(400, 'InvalidParameter', 'duration must be a number of seconds')
+
+        try:
+            credentials = self.server.broker.get(profile, duration)
+        except ProfileNotFound as e:
+            return self.error(404, 'ProfileNotFound', str(e))
+        except KeyError:
+            return self.error(404, 'ProfileNotFound', f'profile {profile} is not configured, use "awssso configure -p {profile}"')
+        except TokenExpired as e:
+            return self.error(503, 'TokenExpired', f'{e}, run "awssso login -p {profile}"')
+        except BotoClientError as e:
+            return self.error(502, 'AssumeRoleFailed', f'{e} (request id: {e.request_id})')
+        except BrokerError as e:
+            return self.error(500, 'Error', str(e))
+        except Exception as e:
+            return self.error(500, 'Error', f'{type(e).__name__}: {e}')
+        self.respond(200, credentials.container)
+
+    def respond(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def error(self, status, code, message):
+        self.respond(status, {'code': code, 'message': message})
+
+    def log_message(self, format, *args):
+        logger.debug('%s %s', self.address_string(), format % args)
+
+
+class CredentialsServer(http.server.HTTPServer):
+    """HTTP server answering on a fixed pool of threads.
+
+    A burst of clients queues up on the workers instead of starting a thread
+    each; connections are closed after each response (HTTP/1.0) so that idle
+    clients do not hold workers.
+    """
+    request_queue_size = 128
+
+    def __init__(self, address, token, patterns=None, workers=DEFAULT_WORKERS, pool=None):
+        self.address_family = socket.AF_INET6 if ':' in address[0] else socket.AF_INET
+        self.broker = CredentialsBroker(pool)
+        self.token = token
+        self.patterns = patterns or []
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        http.server.HTTPServer.__init__(self, address, RequestHandler)
+
+    def server_bind(self):
+        # HTTPServer.server_bind resolves the fully qualified host name, which may wait on DNS
+        socketserver.TCPServer.server_bind(self)
+        self.server_name, self.server_port = self.server_address[:2]
+
+    def serves(self, profile):
+        return bool(profile) and (not self.patterns or any(fnmatch(profile, _) for _ in self.patterns))
+
+    def process_request(self, request, client_address):
+        self._executor.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        http.server.HTTPServer.server_close(self)
+        self._executor.shutdown(wait=False)
+
+
+def load_token(path):
+    """Token clients send in the Authorization header, generated once in `path`."""
+    try:
+        with open(path) as f:
+            token = f.read().strip()
+        if token:
+            return token
+    except FileNotFoundError:
+        pass
+
+    token = token_urlsafe(32)
+    with atomic_write(path) as f:
+        f.write(token)
+    return token
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, token_file=None, patterns=None, workers=DEFAULT_WORKERS,
+          refresh_ahead=DEFAULT_REFRESH_AHEAD, browser_pool=0, browser_idle_timeout=600):
+    token_file = token_file or os.path.join(Configuration().configdir, 'serve.token')
+    token = load_token(token_file)
+
+    pool = None
+    if browser_pool:
+        from awssso.ssodriver import DriverPool
+
+        pool = DriverPool(browser_pool, idle_timeout=browser_idle_timeout)
+        threading.Thread(target=pool.watch, daemon=True).start()
+
+    server = CredentialsServer((host, port), token, patterns, workers, pool)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        host, port = server.server_address[:2]
+        profile = patterns[0] if patterns and len(patterns) == 1 and not any(_ in patterns[0] for _ in '*?[') else '<profile>'
+        print(f'export AWS_CONTAINER_CREDENTIALS_FULL_URI=http://{f"[{host}]" if ":" in host else host}:{port}/{profile}')
+        print(f'export AWS_CONTAINER_AUTHORIZATION_TOKEN_FILE={token_file}', flush=True)
+
+        if refresh_ahead:
+            threading.Thread(target=server.broker.refresh_ahead, args=(refresh_ahead, ), daemon=True).start()
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if pool:
+            pool.close()
@@ -1,29 +1,105 @@
-import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from awssso.transport import get_transport
+
 
 class SSOClient():
-    def __init__(self, token, region='eu-west-1'):
+    def __init__(self, token, region='eu-west-1', catalogue=None, transport=None):
         self._token = token
         self._region = region
-        self._s = requests.Session()
-        self._s.headers.update({
+        self._catalogue = catalogue
+        self._transport = transport or get_transport()
+        self._headers = {
             'x-amz-sso_bearer_token': self._token
-        })
+        }
+
+    @property
+    def transport(self):
+        return self._transport
+
+    def _get(self, url, **kwargs):
+        # The portal throttles with 429 responses, the transport backs off and tries again
+        return self._transport.get(url, headers=self._headers, **kwargs)
+
+    def _paginate(self, url):
+        params = {}
+        while True:
+            payload = self._get(url, params=params).json()
+            yield from payload['result']
+            if not payload.get('paginationToken'):
+                break
+            params = {'paginationToken': payload['paginationToken']}
 
     def whoami(self):
-        r = self._s.get(f'https://portal.sso.{self._region}.amazonaws.com/token/whoAmI')
+        r = self._get(f'{self._transport.portal_url(self._region)}/token/whoAmI')
         return r.json()
 
-    def get_instances(self):
-        r = self._s.get(f'https://portal.sso.{self._region}.amazonaws.com/instance/appinstances')
-        return [i for i in r.json()['result'] if i['applicationName'] == 'AWS Account']
+    def get_instances(self, refresh=False):
+        if self._catalogue and not refresh:
+            instances = self._catalogue.instances()
+            if instances is not None:
+                return instances
+
+        url = f'{self._transport.portal_url(self._region)}/instance/appinstances'
+        instances = [i for i in self._paginate(url) if i['applicationName'] == 'AWS Account']
+        if self._catalogue:
+            self._catalogue.set_instances(instances)
+        return instances
+
+    def _cached_profiles(self, instance_id, refresh=False):
+        if self._catalogue and not refresh:
+            return self._catalogue.profiles(instance_id)
+        return None
 
-    def get_profiles(self, instance_id):
-        r = self._s.get(f'https://portal.sso.{self._region}.amazonaws.com/instance/appinstance/{instance_id}/profiles')
-        return r.json()['result']
+    def _fetch_profiles(self, instance_id):
+        url = f'{self._transport.portal_url(self._region)}/instance/appinstance/{instance_id}/profiles'
+        return list(self._paginate(url))
+
+    def get_profiles(self, instance_id, refresh=False):
+        profiles = self._cached_profiles(instance_id, refresh)
+        if profiles is not None:
+            return profiles
+
+        profiles = self._fetch_profiles(instance_id)
+        if self._catalogue:
+            self._catalogue.set_profiles(instance_id, profiles)
+        return profiles
+
+    def iter_profiles(self, instances, workers=10, refresh=False):
+        """Yield (instance, profiles) pairs as soon as the profiles of an instance are fetched.
+
+        Profiles fetched from the portal are written to the catalogue once, at the end.
+        """
+        fetched = {}
+
+        def get_profiles(instance_id):
+            profiles = self._cached_profiles(instance_id, refresh)
+            if profiles is None:
+                profiles = fetched[instance_id] = self._fetch_profiles(instance_id)
+            return profiles
+
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                futures = {executor.submit(get_profiles, _['id']): _ for _ in instances}
+                for future in as_completed(futures):
+                    yield futures[future], future.result()
+        finally:
+            if self._catalogue:
+                self._catalogue.set_many_profiles(fetched)
 
     def get_saml_payload(self, instance_id, profile_id):
-        for profile in self.get_profiles(instance_id):
+        # A cached profile url saves the profiles round trip, it is dropped
+        # from the catalogue if the portal does not accept it anymore.
+        if self._catalogue:
+            url = self._catalogue.profile_url(instance_id, profile_id)
+            if url:
+                r = self._get(url)
+                if r.ok:
+                    return r.json()['encodedResponse']
+                self._catalogue.invalidate(instance_id)
+
+        for profile in self.get_profiles(instance_id, refresh=bool(self._catalogue)):
             if profile['id'] == profile_id:
                 url = profile['url']
-        r = self._s.get(url)
+        r = self._get(url)
         return r.json()['encodedResponse']
@@ -1,13 +1,22 @@
+import logging
 import pickle
+import threading
+from contextlib import contextmanager
 from hashlib import sha256
+from time import perf_counter, sleep, time
 
 from selenium import webdriver
-from selenium.common.exceptions import TimeoutException, NoSuchElementException
+from selenium.common.exceptions import (NoSuchElementException, StaleElementReferenceException,
+                                        TimeoutException, WebDriverException)
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 
+from awssso.timings import span
+
+logger = logging.getLogger(__name__)
+
 
 class Error(Exception):
     """Base class for SSODriver exceptions."""
@@ -36,16 +45,23 @@ class MFACodeNeeded(Error):
 
 
 class SSODriver():
-    def __init__(self, url, username, headless=True, cookie_dir=None):
+    # Elements the portal may show after a sign in attempt, by order of precedence
+    OUTCOMES = [
+        ('dashboard', By.TAG_NAME, 'portal-dashboard'),
+        ('alert', By.CSS_SELECTOR, '#alertFrame div.a-alert-error'),
+        ('mfa', By.ID, 'mfa_form'),
+    ]
+
+    def __init__(self, url, username, headless=True, cookie_dir=None, pool=None, timeout=30):
         self._url = url
         self._cookie_hash = SSODriver.hash(f'{username}@{url}')
         self._cookie_file = f'{cookie_dir}/{self._cookie_hash}.pkl' if cookie_dir else None
-        chrome_options = Options()
-        if headless:
-            chrome_options.add_argument('--headless')
-        self._driver = webdriver.Chrome(chrome_options=chrome_options)
-        self._driver.implicitly_wait(5)
+        self._pool = pool
+        self._timeout = timeout
         self._poll_frequency = 0.05
+        self._timings = []
+        with self._stage('start'):
+            self._driver = pool.acquire() if pool else SSODriver.new_webdriver(headless)
 
     def __enter__(self):
         return self
@@ -57,15 +73,55 @@ class SSODriver():
     def hash(s):
         return sha256(s.encode()).hexdigest()
 
-    def _load_cookies(self):
+    @staticmethod
+    def new_webdriver(headless=True):
+        chrome_options = Options()
+        if headless:
+            chrome_options.add_argument('--headless')
+        driver = webdriver.Chrome(chrome_options=chrome_options)
+        # Explicit waits only, an implicit wait would stall every failed lookup
+        driver.implicitly_wait(0)
+        return driver
+
+    @staticmethod
+    def read_cookies(cookie_file):
         try:
-            cookies = pickle.load(open(self._cookie_file, 'rb'))
-            for cookie in cookies:
-                if 'expiry' in cookie:
-                    del cookie['expiry']
-                self._driver.add_cookie(cookie)
-        except FileNotFoundError:
-            pass
+            with open(cookie_file, 'rb') as f:
+                return pickle.load(f)
+        except (FileNotFoundError, TypeError):
+            return []
+
+    @staticmethod
+    def write_cookies(cookie_file, cookies):
+        with open(cookie_file, 'wb') as f:
+            pickle.dump(cookies, f)
+
+    @property
+    def timings(self):
+        """(stage, seconds) pairs of the steps run so far."""
+        return list(self._timings)
+
+    @contextmanager
+    def _stage(self, name):
+        start = perf_counter()
+        try:
+            with span(f'signin.{name}'):
+                yield
+        finally:
+            elapsed = perf_counter() - start
+            self._timings.append((name, elapsed))
+            logger.debug('%s: %.3fs', name, elapsed)
+
+    def _load_cookies(self):
+        if self._pool:
+            cookies = self._pool.cookies(self._cookie_hash, self._cookie_file)
+        else:
+            cookies = SSODriver.read_cookies(self._cookie_file)
+        for cookie in cookies:
+            cookie = dict(cookie)
+            if 'expiry' in cookie:
+                del cookie['expiry']
+            self._driver.add_cookie(cookie)
 
     def _dump_cookies(self):
         cookies = []
@@ -73,7 +129,10 @@ class SSODriver():
         for cookie in self._driver.get_cookies():
             if cookie['name'] not in exclude:
                 cookies.append(cookie)
-        pickle.dump(cookies, open(self._cookie_file, 'wb'))
+        if self._pool:
+            self._pool.set_cookies(self._cookie_hash, self._cookie_file, cookies)
+        else:
+            SSODriver.write_cookies(self._cookie_file, cookies)
 
     def _find_element_by_id(self, element_id, driver=None, timeout=5):
         driver = driver or self._driver
@@ -86,33 +145,81 @@ class SSODriver():
         element.click()
         return element
 
+    def wait_outcome(self, outcomes=None, timeout=None):
+        """Wait for the first of `outcomes` to show up and return its (name, element).
+
+        All outcomes are polled together, so that whichever the portal
+        displays is seen right away instead of after the others timed out.
+        """
+        outcomes = [_ for _ in SSODriver.OUTCOMES if outcomes is None or _[0] in outcomes]
+
+        def first_displayed(driver):
+            for name, by, value in outcomes:
+                for element in driver.find_elements(by, value):
+                    if name == 'dashboard' or element.is_displayed():
+                        return (name, element)
+            return False
+
+        wait = WebDriverWait(
+            self._driver, timeout or self._timeout, poll_frequency=self._poll_frequency,
+            ignored_exceptions=(StaleElementReferenceException, )
+        )
+        return wait.until(first_displayed)
+
+    def _raise_outcome(self, name, element):
+        if name == 'alert':
+            raise AlertMessage(self._alert_message(element))
+        if name == 'mfa':
+            raise MFACodeNeeded(element)
+
+    def _alert_message(self, alert):
+        try:
+            error = alert.find_element_by_css_selector('div.a-box-inner > h4').text
+            message = alert.find_element_by_css_selector('div.a-box-inner > div.gwt-Label').text
+            return f'{error}: {message}'
+        except NoSuchElementException:
+            return alert.text
+
     def refresh_token(self, username, password, restore=False):
-        self.get()
-        self.login(username, password)
+        with self._stage('load'):
+            self.get()
+        with self._stage('login'):
+            self.login(username, password)
         try:
-            return self.get_token(restore)
+            with self._stage('wait'):
+                name, element = self.wait_outcome()
         except TimeoutException:
-            self.check_alert()
-            self.check_mfa()
+            raise AlertMessage(f'Timed out after {self._timeout}s waiting for the portal')
+        self._raise_outcome(name, element)
+        return self.get_token(restore)
 
     def get_token(self, restore=False):
-        WebDriverWait(self._driver, 1, poll_frequency=self._poll_frequency).until(
-            EC.presence_of_element_located((By.TAG_NAME, 'portal-dashboard'))
-        )
-        self._driver.get(self._url)
-        cookie = self._driver.get_cookie('x-amz-sso_authn')
-        if restore:
-            self._driver.back()
+        try:
+            with self._stage('dashboard'):
+                name, element = self.wait_outcome(['dashboard', 'alert'])
+        except TimeoutException:
+            raise AlertMessage(f'Timed out after {self._timeout}s waiting for the portal')
+        self._raise_outcome(name, element)
+
+        with self._stage('token'):
+            self._driver.get(self._url)
+            cookie = self._driver.get_cookie('x-amz-sso_authn')
+            if restore:
+                self._driver.back()
         return (cookie['value'], cookie['expiry'])
 
     def close(self):
-        if self._cookie_file:
-            self._dump_cookies()
-        self._driver.quit()
+        with self._stage('close'):
+            if self._cookie_file or self._pool:
+                self._dump_cookies()
+            if self._pool:
+                self._pool.release(self._driver)
+            else:
+                self._driver.quit()
 
     def get(self):
         self._driver.get(self._url)
-        if self._cookie_file:
+        if self._cookie_file or self._pool:
             self._load_cookies()
         return self._driver
 
@@ -127,31 +234,125 @@ class SSODriver():
         el_password.send_keys(password)
         el_signin.click()
 
-    def check_alert(self):
+    def check_alert(self, timeout=1):
         try:
-            wait = WebDriverWait(self._driver, 1, poll_frequency=self._poll_frequency)
-            alert = wait.until(EC.presence_of_element_located((By.ID, 'alertFrame')))
-            error = alert.find_element_by_css_selector('div.a-alert-error > div.a-box-inner > h4').text
-            message = alert.find_element_by_css_selector('div.a-alert-error > div.a-box-inner > div.gwt-Label').text
-            raise AlertMessage(f'{error}: {message}')
-        except (TimeoutException, NoSuchElementException):
+            self._raise_outcome(*self.wait_outcome(['alert'], timeout))
+        except TimeoutException:
             pass
 
-    def check_mfa(self):
+    def check_mfa(self, timeout=1):
         try:
-            wait = WebDriverWait(self._driver, 1, poll_frequency=self._poll_frequency)
-            mfa = wait.until(EC.presence_of_element_located((By.ID, 'mfa_form')))
-            raise MFACodeNeeded(mfa)
+            self._raise_outcome(*self.wait_outcome(['mfa'], timeout))
         except TimeoutException:
             pass
 
     def send_mfa(self, mfa_form, mfacode, trusted_device=True):
-        el_mfacode = self._find_element_by_id('wdc_mfacode', mfa_form)
-        el_mfacheckbox = self._find_element_by_id('wdc_mfacheckbox', mfa_form)
-        el_signin = self._find_element_by_id('wdc_login_button', mfa_form)
-
-        el_mfacode.clear()
-        el_mfacode.send_keys(mfacode)
-        if trusted_device:
-            el_mfacheckbox.click()
-        el_signin.click()
+        with self._stage('mfa'):
+            el_mfacode = self._find_element_by_id('wdc_mfacode', mfa_form)
+            el_mfacheckbox = self._find_element_by_id('wdc_mfacheckbox', mfa_form)
+            el_signin = self._find_element_by_id('wdc_login_button', mfa_form)
+
+            el_mfacode.clear()
+            el_mfacode.send_keys(mfacode)
+            if trusted_device:
+                el_mfacheckbox.click()
+            el_signin.click()
+
+
+class DriverPool():
+    """Warm headless Chrome instances shared by SSODriver across token refreshes.
+
+    Cookies of each username / url are kept in memory between refreshes and
+    cleared from the browser when it goes back to the pool. Browsers idle for
+    longer than `idle_timeout` seconds are shut down.
+    """
+
+    def __init__(self, size=1, headless=True, idle_timeout=600):
+        self._headless = headless
+        self._idle_timeout = idle_timeout
+        self._idle = []
+        self._jars = {}
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @staticmethod
+    def healthy(driver):
+        try:
+            driver.current_url
+            return True
+        except WebDriverException:
+            return False
+
+    @staticmethod
+    def _quit(driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _clear_cookies(driver):
+        # execute_cdp_cmd is missing from older Selenium 3 releases, which can
+        # only delete the cookies of the current domain
+        if hasattr(driver, 'execute_cdp_cmd'):
+            driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+        else:
+            driver.delete_all_cookies()
+
+    def acquire(self):
+        self._slots.acquire()
+        try:
+            with self._lock:
+                while self._idle:
+                    driver, _ = self._idle.pop()
+                    if DriverPool.healthy(driver):
+                        return driver
+                    DriverPool._quit(driver)
+            return SSODriver.new_webdriver(self._headless)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, driver):
+        try:
+            DriverPool._clear_cookies(driver)
+            driver.get('about:blank')
+            with self._lock:
+                self._idle.append((driver, time()))
+        except Exception:
+            # A browser that can not be cleaned up is not reused
+            DriverPool._quit(driver)
+        finally:
+            self._slots.release()
+
+    def cookies(self, key, cookie_file=None):
+        with self._lock:
+            if key not in self._jars:
+                self._jars[key] = (cookie_file, SSODriver.read_cookies(cookie_file))
+            return list(self._jars[key][1])
+
+    def set_cookies(self, key, cookie_file, cookies):
+        with self._lock:
+            self._jars[key] = (cookie_file, list(cookies))
+
+    def reap(self):
+        with self._lock:
+            expired = [_ for _ in self._idle if time() - _[1] > self._idle_timeout]
+            self._idle = [_ for _ in self._idle if _ not in expired]
+        for driver, _ in expired:
+            DriverPool._quit(driver)
+
+    def watch(self, interval=30):
+        while True:
+            sleep(interval)
+            self.reap()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+            jars = dict(self._jars)
+        for driver, _ in idle:
+            DriverPool._quit(driver)
+        for cookie_file, cookies in jars.values():
+            if cookie_file:
+                SSODriver.write_cookies(cookie_file, cookies)
@@ -0,0 +1,242 @@
+import pickle
+from hashlib import sha256
+from html.parser import HTMLParser
+from time import time
+from urllib.parse import urljoin
+
+import requests
+from requests.cookies import RequestsCookieJar
+
+from awssso.ssodriver import AlertMessage, MFACodeNeeded
+from awssso.transport import get_transport
+
+# Lifetime assumed for an authn token set as a session cookie (no expiry),
+# the portal usually keeps users signed in for 8 hours
+DEFAULT_TOKEN_LIFETIME = 8 * 3600
+
+
+class Error(Exception):
+    """Base class for SSOHTTPDriver exceptions."""
+
+    def __init__(self, msg=''):
+        self.message = msg
+        Exception.__init__(self, msg)
+
+    def __repr__(self):
+        return self.message
+
+    __str__ = __repr__
+
+
+class UnsupportedPortal(Error):
+    """Raised when the sign in page can not be handled without a browser."""
+    pass
+
+
+class Form():
+    def __init__(self, attrs):
+        self.id = attrs.get('id')
+        self.action = attrs.get('action', '')
+        self.method = attrs.get('method', 'get').lower()
+        self.inputs = []
+
+    def field(self, element_id):
+        for _ in self.inputs:
+            if _.get('id') == element_id:
+                return _
+        return None
+
+    def data(self, values=None):
+        """Form data with `values` (keyed by element id) replacing default values."""
+        values = values or {}
+        data = {}
+        for _ in self.inputs:
+            name = _.get('name')
+            if not name:
+                continue
+            if _.get('id') in values:
+                value = values[_['id']]
+                if value is None:
+                    continue
+                data[name] = value
+            elif _.get('type') in ('checkbox', 'radio'):
+                if 'checked' in _:
+                    data[name] = _.get('value') or 'on'
+            elif _.get('type') not in ('submit', 'button'):
+                data[name] = _.get('value') or ''
+        return data
+
+
+class PageParser(HTMLParser):
+    """Extracts forms and the error alert from a portal sign in page."""
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.forms = []
+        self.alert = []
+        self._form = None
+        self._alert_depth = 0
+        self._stack = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = {k: (v if v is not None else '') for k, v in attrs}
+        if tag == 'form':
+            self._form = Form(attrs)
+            self.forms.append(self._form)
+        elif tag in ('input', 'button') and self._form is not None:
+            attrs.setdefault('type', 'submit' if tag == 'button' else 'text')
+            self._form.inputs.append(attrs)
+
+        if tag in ('input', 'br', 'img', 'meta', 'link', 'hr'):
+            return
+        if attrs.get('id') == 'alertFrame':
+            self._alert_depth = len(self._stack) + 1
+        self._stack.append((tag, attrs.get('class', '')))
+
+    def handle_endtag(self, tag):
+        if tag == 'form':
+            self._form = None
+        while self._stack:
+            if self._stack.pop()[0] == tag:
+                break
+        if self._alert_depth > len(self._stack):
+            self._alert_depth = 0
+
+    def handle_data(self, data):
+        if self._alert_depth and data.strip():
+            classes = ' '.join(_[1] for _ in self._stack)
+            if 'a-alert-error' in classes:
+                self.alert.append(data.strip())
+
+    def form(self, element_id):
+        """Return the form with `element_id`, or the one holding an element with that id."""
+        for _ in self.forms:
+            if _.id == element_id or _.field(element_id):
+                return _
+        return None
+
+
+class SSOHTTPDriver():
+    """Browserless alternative to SSODriver, exchanging the sign in forms over plain HTTP.
+
+    It has the same interface as SSODriver; sign in pages that need a
+    browser to be rendered raise UnsupportedPortal. Requests go through the
+    shared transport (pools, timeouts, retries), the cookies of the sign in
+    are kept by the driver.
+    """
+
+    TOKEN_COOKIE = 'x-amz-sso_authn'
+
+    def __init__(self, url, username, headless=True, cookie_dir=None, transport=None):
+        self._url = url
+        self._cookie_hash = SSOHTTPDriver.hash(f'{username}@{url}')
+        self._cookie_file = f'{cookie_dir}/{self._cookie_hash}.http.pkl' if cookie_dir else None
+        self._transport = transport or get_transport()
+        self._cookies = RequestsCookieJar()
+        self._page = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @staticmethod
+    def hash(s):
+        return sha256(s.encode()).hexdigest()
+
+    def _load_cookies(self):
+        try:
+            with open(self._cookie_file, 'rb') as f:
+                self._cookies.update(pickle.load(f))
+        except FileNotFoundError:
+            pass
+
+    def _dump_cookies(self):
+        cookies = RequestsCookieJar()
+        for cookie in self._cookies:
+            if cookie.name != SSOHTTPDriver.TOKEN_COOKIE:
+                cookies.set_cookie(cookie)
+        with open(self._cookie_file, 'wb') as f:
+            pickle.dump(cookies, f)
+
+    def _request(self, method, url, **kwargs):
+        r = self._transport.request(method, url, cookies=self._cookies, **kwargs)
+        # Including the cookies set along redirects
+        for response in (*r.history, r):
+            self._cookies.update(response.cookies)
+        return r
+
+    def _parse(self, response):
+        try:
+            response.raise_for_status()
+        except requests.HTTPError:
+            raise UnsupportedPortal(f'{response.url} returned HTTP {response.status_code}')
+        parser = PageParser()
+        parser.feed(response.text)
+        self._page = (response.url, parser)
+        return parser
+
+    def _submit(self, form, values):
+        url = urljoin(self._page[0], form.action)
+        if form.method == 'get':
+            r = self._request('GET', url, params=form.data(values))
+        else:
+            r = self._request('POST', url, data=form.data(values))
+        return self._parse(r)
+
+    def _token_cookie(self):
+        for cookie in self._cookies:
+            if cookie.name == SSOHTTPDriver.TOKEN_COOKIE:
+                return cookie
+        return None
+
+    def refresh_token(self, username, password, restore=False):
+        self.get()
+        self.login(username, password)
+        self.check_alert()
+        self.check_mfa()
+        return self.get_token(restore)
+
+    def get_token(self, restore=False):
+        cookie = self._token_cookie()
+        if cookie is None:
+            self._parse(self._request('GET', self._url))
+            self.check_alert()
+            cookie = self._token_cookie()
+        if cookie is None:
+            raise UnsupportedPortal('no authn token after sign in')
+        return (cookie.value, cookie.expires or int(time()) + DEFAULT_TOKEN_LIFETIME)
+
+    def close(self):
+        if self._cookie_file:
+            self._dump_cookies()
+
+    def get(self):
+        if self._cookie_file:
+            self._load_cookies()
+        return self._parse(self._request('GET', self._url))
+
+    def login(self, username, password):
+        form = self._page[1].form('wdc_username')
+        if form is None or not form.field('wdc_password'):
+            raise UnsupportedPortal(f'no sign in form found at {self._page[0]}')
+        self._submit(form, {'wdc_username': username, 'wdc_password': password})
+
+    def check_alert(self):
+        alert = self._page[1].alert
+        if alert:
+            raise AlertMessage(': '.join(alert[:2]))
+
+    def check_mfa(self):
+        form = self._page[1].form('mfa_form')
+        if form is not None:
+            raise MFACodeNeeded(form)
+
+    def send_mfa(self, mfa_form, mfacode, trusted_device=True):
+        values = {'wdc_mfacode': mfacode}
+        checkbox = mfa_form.field('wdc_mfacheckbox')
+        if checkbox is not None:
+            values['wdc_mfacheckbox'] = (checkbox.get('value') or 'on') if trusted_device else None
+        self._submit(mfa_form, values)
+        self.check_alert()
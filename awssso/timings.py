@@ -0,0 +1,164 @@
+"""Lightweight latency tracing of the login hot path.
+
+Spans are only recorded once the tracer is enabled (`awssso --timings`),
+otherwise `span` returns a shared no-op context manager.
+"""
+import json
+import os
+import socket
+import sys
+import threading
+from functools import wraps
+from time import perf_counter, time
+
+
+class Span():
+    def __init__(self, tracer, name, parent, attributes):
+        self._tracer = tracer
+        self.name = name
+        self.parent = parent
+        self.attributes = attributes
+        self.span_id = os.urandom(8).hex()
+        self.depth = parent.depth + 1 if parent else 0
+        self.start_time = time()
+        self.start = perf_counter()
+        self.end = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        self.end = perf_counter()
+        self._tracer._finish(self)
+
+    @property
+    def duration(self):
+        return (self.end or perf_counter()) - self.start
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+
+class NoopSpan():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def set(self, key, value):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Tracer():
+    def __init__(self):
+        self.enabled = False
+        self.trace_id = os.urandom(16).hex()
+        self._spans = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def span(self, name, parent=None, **attributes):
+        """Context manager timing the block as `name`, nested in the current span of the thread.
+
+        `parent` attaches the span to a span of another thread.
+        """
+        if not self.enabled:
+            return NOOP_SPAN
+        stack = self._stack()
+        span = Span(self, name, parent or (stack[-1] if stack else None), attributes)
+        stack.append(span)
+        with self._lock:
+            self._spans.append(span)
+        return span
+
+    def _finish(self, span):
+        stack = self._stack()
+        if span in stack:
+            stack.remove(span)
+
+    def current(self):
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def timed(self, name):
+        """Decorator timing each call of the function as `name`."""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def spans(self):
+        with self._lock:
+            return sorted(self._spans, key=lambda _: _.start)
+
+    def tree(self):
+        """Spans depth first, children in start order."""
+        children = {}
+        for _ in self.spans():
+            children.setdefault(_.parent, []).append(_)
+
+        def walk(parent):
+            for _ in children.get(parent, []):
+                yield _
+                yield from walk(_)
+        return list(walk(None))
+
+    def report(self, fmt='table', file=sys.stderr):
+        spans = self.tree()
+        if fmt == 'json':
+            origin = min((_.start for _ in spans), default=0)
+            print(json.dumps([{
+                'name': _.name,
+                'depth': _.depth,
+                'start_ms': round((_.start - origin) * 1000, 3),
+                'duration_ms': round(_.duration * 1000, 3),
+                'attributes': _.attributes
+            } for _ in spans]), file=file)
+            return
+
+        width = max([len(_.name) + 2 * _.depth for _ in spans] + [4])
+        for _ in spans:
+            attributes = ' '.join(f'{k}={v}' for k, v in _.attributes.items())
+            print(f'{"  " * _.depth + _.name:{width}}  {_.duration * 1000:9.1f} ms  {attributes}'.rstrip(), file=file)
+
+    def export(self, path):
+        """Append spans to `path` as JSON lines shaped like OpenTelemetry spans."""
+        resource = {
+            'service.name': 'awssso',
+            'host.name': socket.gethostname(),
+            'process.pid': os.getpid()
+        }
+        with open(path, 'a') as f:
+            for _ in self.spans():
+                f.write(json.dumps({
+                    'traceId': self.trace_id,
+                    'spanId': _.span_id,
+                    'parentSpanId': _.parent.span_id if _.parent else '',
+                    'name': _.name,
+                    'startTimeUnixNano': int(_.start_time * 1e9),
+                    'endTimeUnixNano': int((_.start_time + _.duration) * 1e9),
+                    'attributes': _.attributes,
+                    'resource': resource
+                }) + '\n')
+
+
+tracer = Tracer()
+span = tracer.span
+timed = tracer.timed
@@ -0,0 +1,154 @@
+import random
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from time import sleep
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from awssso.timings import span
+
+DEFAULTS = {
+    'connect_timeout': 5,
+    'read_timeout': 30,
+    'max_retries': 5,
+    'pool_size': 10,
+    'sts_region': None,
+    'sts_endpoint': None,
+    'portal_endpoint': None,
+    'federation_endpoint': None
+}
+
+# Profile settings read by transport_settings
+SETTINGS = {
+    'http_connect_timeout': ('connect_timeout', float),
+    'http_read_timeout': ('read_timeout', float),
+    'http_max_retries': ('max_retries', int),
+    'http_pool_size': ('pool_size', int),
+    'sts_region': ('sts_region', str),
+    'sts_endpoint': ('sts_endpoint', str),
+    'portal_endpoint': ('portal_endpoint', str),
+    'federation_endpoint': ('federation_endpoint', str)
+}
+
+
+def backoff_delay(attempt, retry_after=None, base=0.5, cap=20):
+    """Seconds to wait before retry number `attempt`: Retry-After if given, else exponential with jitter."""
+    if retry_after and retry_after.isdigit():
+        return min(cap, int(retry_after))
+    return min(cap, base * 2 ** attempt) * random.uniform(0.5, 1)
+
+
+class Transport():
+    """HTTP and STS clients shared by the portal, federation and STS calls of a process.
+
+    Connections are kept alive in pools, every call has connect / read
+    timeouts, and throttled (429) or failed (5xx, connection errors) calls
+    are retried with exponential backoff and jitter.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, connect_timeout=5, read_timeout=30, max_retries=5, pool_size=10, sts_region=None, sts_endpoint=None, portal_endpoint=None,
+                 federation_endpoint=None, backoff=0.5, backoff_cap=20):
+        self._timeout = (connect_timeout, read_timeout)
+        self._sts_region = sts_region
+        self._sts_endpoint = sts_endpoint
+        self._portal_endpoint = portal_endpoint.rstrip('/') if portal_endpoint else None
+        self._federation_endpoint = federation_endpoint
+        self._max_retries = max_retries
+        self._pool_size = pool_size
+        self._backoff = backoff
+        self._backoff_cap = backoff_cap
+        self._s = requests.Session()
+        # The session is shared by every user of the process, it never keeps
+        # cookies: callers needing some pass and collect their own (see SSOHTTPDriver)
+        self._s.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self._s.mount('https://', adapter)
+        self._s.mount('http://', adapter)
+        self._sts = {}
+        self._lock = threading.Lock()
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    def portal_url(self, region):
+        """Base url of the AWS SSO portal API of `region`, unless portal_endpoint overrides it."""
+        return self._portal_endpoint or f'https://portal.sso.{region}.amazonaws.com'
+
+    def federation_url(self):
+        """Url of the AWS federation endpoint (getSigninToken, console login), unless federation_endpoint overrides it."""
+        return self._federation_endpoint or 'https://signin.aws.amazon.com/federation'
+
+    def retry_delay(self, response, attempt):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        return backoff_delay(attempt, retry_after, self._backoff, self._backoff_cap)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self._timeout)
+        # Only the path is traced, query strings may carry credentials
+        parsed = urlparse(url)
+        with span(f'http.{method.lower()}', host=parsed.netloc, path=parsed.path) as s:
+            for attempt in range(self._max_retries + 1):
+                s.set('attempts', attempt + 1)
+                try:
+                    r = self._s.request(method, url, **kwargs)
+                except (requests.ConnectionError, requests.Timeout):
+                    if attempt == self._max_retries:
+                        raise
+                    sleep(self.retry_delay(None, attempt))
+                    continue
+                s.set('status', r.status_code)
+                if r.status_code not in Transport.RETRY_STATUSES or attempt == self._max_retries:
+                    return r
+                sleep(self.retry_delay(r, attempt))
+
+    def sts(self, region=None):
+        """Return the STS client of `region` (default: sts_region, or from the AWS config), created once."""
+        region = region or self._sts_region
+        with self._lock:
+            if region not in self._sts:
+                with span('sts.client', region=region):
+                    import boto3
+                    from botocore.config import Config
+
+                    config = Config(
+                        connect_timeout=self._timeout[0],
+                        read_timeout=self._timeout[1],
+                        retries={'max_attempts': self._max_retries},
+                        max_pool_connections=self._pool_size
+                    )
+                    # AssumeRoleWithSAML does not need AWS credentials
+                    self._sts[region] = boto3.client(
+                        'sts', region_name=region, config=config, endpoint_url=self._sts_endpoint,
+                        aws_access_key_id='', aws_secret_access_key='', aws_session_token=''
+                    )
+            return self._sts[region]
+
+    def close(self):
+        self._s.close()
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(**settings):
+    """Return the process wide Transport for `settings` (see DEFAULTS)."""
+    settings = {**DEFAULTS, **{k: v for k, v in settings.items() if v is not None}}
+    key = tuple(sorted(settings.items()))
+    with _transports_lock:
+        if key not in _transports:
+            _transports[key] = Transport(**settings)
+        return _transports[key]
+
+
+def transport_settings(params):
+    """Transport settings of a profile (http_connect_timeout, http_read_timeout, ...)."""
+    return {name: cast(params[setting]) for setting, (name, cast) in SETTINGS.items() if params.get(setting)}
@@ -26,11 +26,17 @@ setup_options = dict(
     url='http://github.com/wnkz/aws-sso',
     entry_points={
         'console_scripts': [
-            'awssso=awssso.cli:main'
+            'awssso=awssso.cli:main',
+            'awssso-client=awssso.client:main'
         ],
     },
     packages=find_packages(exclude=['tests*']),
+    python_requires='>=3.7',
     install_requires=requires,
+    extras_require={
+        'async': ['aiohttp>=3.6.0,<4.0.0'],
+        'cache': ['cryptography'],
+    },
     license='Apache License 2.0',
     classifiers=[
         'Development Status :: 5 - Production/Stable',
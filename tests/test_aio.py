@@ -0,0 +1,81 @@
+"""AsyncSSOClient against the fake portal and STS of tools/bench.py."""
+import asyncio
+import os
+import sys
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tools'))
+
+from bench import FakeAPI  # noqa: E402
+
+try:
+    import aiohttp  # noqa: F401
+except ImportError:
+    aio = None
+else:
+    from awssso import aio
+
+from awssso.saml import BotoClientError, SAMLHelper  # noqa: E402
+
+
+class BadGatewayHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        payload = b'<html><body>502 Bad Gateway</body>'
+        self.send_response(502)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@unittest.skipIf(aio is None, 'aiohttp is not installed')
+class AsyncSSOClientTest(unittest.TestCase):
+    def setUp(self):
+        self.api = FakeAPI(3).__enter__()
+        self.addCleanup(self.api.__exit__)
+
+    def client(self):
+        return aio.AsyncSSOClient('token', portal_endpoint=self.api.url, sts_endpoint=f'{self.api.url}/')
+
+    def test_portal_and_sts_endpoints(self):
+        async def run():
+            async with self.client() as sso:
+                return await sso.get_credentials('ins-1', 'p-1')
+
+        credentials = asyncio.run(run())
+        self.assertTrue(credentials.access_key_id.startswith('ASIABENCH'))
+        self.assertEqual(self.api.calls['sts'], 1)
+
+    def test_unknown_profile(self):
+        async def run():
+            async with self.client() as sso:
+                return await sso.get_saml_payload('ins-1', 'p-unknown')
+
+        with self.assertRaises(aio.Error):
+            asyncio.run(run())
+
+    def test_sts_error_without_xml_body(self):
+        server = HTTPServer(('127.0.0.1', 0), BadGatewayHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        async def run():
+            async with self.client() as sso:
+                saml = SAMLHelper(await sso.get_saml_payload('ins-1', 'p-1'))
+                return await aio.assume_role_with_saml(
+                    sso.session, saml, max_retries=0, endpoint_url=f'http://127.0.0.1:{server.server_address[1]}/'
+                )
+
+        with self.assertRaises(BotoClientError) as e:
+            asyncio.run(run())
+        self.assertEqual(e.exception.args[0]['Error']['Code'], '502')
+
+
+if __name__ == '__main__':
+    unittest.main()
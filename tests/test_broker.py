@@ -0,0 +1,49 @@
+"""CredentialsBroker with stub profiles and credentials."""
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from awssso.broker import CredentialsBroker
+from awssso.helpers import CredentialsHelper, SecretsManager
+
+PROFILES = {
+    'bench': {'url': 'https://bench.awsapps.com/start/', 'username': 'bench', 'instance_id': 'ins-1', 'profile_id': 'p-1'},
+    'alice': {'url': 'https://bench.awsapps.com/start/', 'username': 'alice', 'instance_id': 'ins-1', 'profile_id': 'p-1'},
+    'other': {'url': 'https://other.awsapps.com/start/', 'username': 'bench', 'instance_id': 'ins-1', 'profile_id': 'p-1'},
+}
+
+
+class StubBroker(CredentialsBroker):
+    def params(self, profile):
+        return {**PROFILES[profile], 'region': 'eu-west-1'}
+
+    def secrets(self, params):
+        key = (params.get('username'), params.get('url'))
+        return self._secrets.setdefault(key, SecretsManager(params['username'], params['url']))
+
+
+def assume(secrets, sso_factory, instance_id, profile_id, *args, **kwargs):
+    return CredentialsHelper({
+        'AccessKeyId': f'ASIA{secrets._base_service_name}.{secrets._username}',
+        'SecretAccessKey': 'secret',
+        'SessionToken': 'session',
+        'Expiration': datetime.now(timezone.utc) + timedelta(hours=1)
+    })
+
+
+class CredentialsBrokerTest(unittest.TestCase):
+    def test_credentials_of_each_portal_user(self):
+        broker = StubBroker()
+        with mock.patch('awssso.broker.get_or_assume_credentials', side_effect=assume) as assumed, \
+                mock.patch('awssso.broker.Configuration'):
+            credentials = {_: broker.get(_).access_key_id for _ in PROFILES}
+            self.assertEqual(len(set(credentials.values())), len(PROFILES))
+            self.assertEqual(assumed.call_count, len(PROFILES))
+
+            # Served from memory afterwards
+            self.assertEqual({_: broker.get(_).access_key_id for _ in PROFILES}, credentials)
+            self.assertEqual(assumed.call_count, len(PROFILES))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+"""CredentialsServer with a stub broker, as the container credentials provider of AWS SDKs sees it."""
+import http.client
+import json
+import threading
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from botocore.credentials import ContainerProvider
+from botocore.exceptions import CredentialRetrievalError
+
+from awssso.broker import ProfileNotFound, TokenExpired
+from awssso.helpers import CredentialsHelper
+from awssso.server import CredentialsServer
+
+TOKEN = 'secret-token'
+EXPIRATION = (datetime.now(timezone.utc) + timedelta(hours=1)).replace(microsecond=0)
+
+
+class StubBroker():
+    def __init__(self):
+        self.requests = []
+
+    def get(self, profile, duration=None):
+        self.requests.append((profile, duration))
+        if profile.endswith('expired'):
+            raise TokenExpired('token expired')
+        if profile.endswith('unknown'):
+            raise ProfileNotFound(f'profile {profile} does not exist')
+        return CredentialsHelper({
+            'AccessKeyId': f'AKIA{profile.upper()}',
+            'SecretAccessKey': 'secret',
+            'SessionToken': 'session',
+            'Expiration': EXPIRATION
+        })
+
+
+class CredentialsServerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = CredentialsServer(('127.0.0.1', 0), TOKEN, ['dev-*'], workers=2)
+        self.server.broker = StubBroker()
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def get(self, path, token=TOKEN):
+        connection = http.client.HTTPConnection(*self.server.server_address[:2], timeout=5)
+        self.addCleanup(connection.close)
+        connection.request('GET', path, headers={'Authorization': token} if token is not None else {})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+
+    def test_missing_token(self):
+        status, body = self.get('/dev-a', token=None)
+        self.assertEqual(status, 401)
+        self.assertEqual(body['code'], 'Unauthorized')
+        self.assertEqual(self.server.broker.requests, [])
+
+    def test_bad_token(self):
+        self.assertEqual(self.get('/dev-a', token='wrong')[0], 401)
+        self.assertEqual(self.get('/dev-a', token=f'Bearer {TOKEN}x')[0], 401)
+        self.assertEqual(self.server.broker.requests, [])
+
+    def test_bearer_token(self):
+        self.assertEqual(self.get('/dev-a', token=f'Bearer {TOKEN}')[0], 200)
+
+    def test_pattern_filtering(self):
+        status, body = self.get('/prod-a')
+        self.assertEqual(status, 404)
+        self.assertEqual(body['code'], 'ProfileNotFound')
+        self.assertEqual(self.get('/')[0], 404)
+        self.assertEqual(self.server.broker.requests, [])
+
+    def test_container_credentials(self):
+        status, body = self.get('/dev-a?duration=900')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, {
+            'AccessKeyId': 'AKIADEV-A',
+            'SecretAccessKey': 'secret',
+            'Token': 'session',
+            'Expiration': EXPIRATION.strftime('%Y-%m-%dT%H:%M:%SZ')
+        })
+        self.assertEqual(self.server.broker.requests, [('dev-a', 900)])
+
+    def test_errors(self):
+        self.assertEqual(self.get('/dev-unknown'), (404, {'code': 'ProfileNotFound', 'message': 'profile dev-unknown does not exist'}))
+        status, body = self.get('/dev-expired')
+        self.assertEqual((status, body['code']), (503, 'TokenExpired'))
+        status, body = self.get('/dev-a?duration=soon')
+        self.assertEqual((status, body['code']), (400, 'InvalidParameter'))
+
+    def test_botocore_container_provider(self):
+        provider = ContainerProvider(environ={
+            'AWS_CONTAINER_CREDENTIALS_FULL_URI': f'{self.url}/dev-a',
+            'AWS_CONTAINER_AUTHORIZATION_TOKEN': TOKEN
+        })
+        credentials = provider.load().get_frozen_credentials()
+        self.assertEqual(credentials.access_key, 'AKIADEV-A')
+        self.assertEqual(credentials.secret_key, 'secret')
+        self.assertEqual(credentials.token, 'session')
+
+    def test_botocore_container_provider_bad_token(self):
+        provider = ContainerProvider(environ={
+            'AWS_CONTAINER_CREDENTIALS_FULL_URI': f'{self.url}/dev-a',
+            'AWS_CONTAINER_AUTHORIZATION_TOKEN': 'wrong'
+        })
+        with self.assertRaises(CredentialRetrievalError):
+            provider.load()
+
+
+if __name__ == '__main__':
+    unittest.main()
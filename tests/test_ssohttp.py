@@ -0,0 +1,89 @@
+"""SSOHTTPDriver against the local fake portal of tools/fakeportal.py."""
+import os
+import sys
+import tempfile
+import unittest
+from time import time
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tools'))
+
+from fakeportal import FakePortal  # noqa: E402
+
+from awssso.ssodriver import AlertMessage, MFACodeNeeded  # noqa: E402
+from awssso.ssohttp import DEFAULT_TOKEN_LIFETIME, SSOHTTPDriver, UnsupportedPortal  # noqa: E402
+from awssso.transport import Transport  # noqa: E402
+
+
+class SSOHTTPDriverTest(unittest.TestCase):
+    def portal(self, **kwargs):
+        portal = FakePortal(**kwargs).start()
+        self.addCleanup(portal.stop)
+        return portal
+
+    def driver(self, url, cookie_dir=None, transport=None):
+        driver = SSOHTTPDriver(url, 'me', cookie_dir=cookie_dir, transport=transport)
+        self.addCleanup(driver.close)
+        return driver
+
+    def test_sign_in(self):
+        portal = self.portal(token_ttl=3600)
+        token, expiry = self.driver(portal.url).refresh_token('me', 'secret')
+        self.assertTrue(portal.valid_token(token))
+        self.assertAlmostEqual(expiry, time() + 3600, delta=5)
+
+    def test_session_cookie_gets_default_lifetime(self):
+        portal = self.portal(session_cookie=True)
+        token, expiry = self.driver(portal.url).refresh_token('me', 'secret')
+        self.assertTrue(portal.valid_token(token))
+        self.assertAlmostEqual(expiry, time() + DEFAULT_TOKEN_LIFETIME, delta=5)
+
+    def test_shared_transport(self):
+        portal = self.portal()
+        transport = Transport(max_retries=0)
+        self.addCleanup(transport.close)
+        with mock.patch.object(transport, 'request', wraps=transport.request) as request:
+            token, _ = self.driver(portal.url, transport=transport).refresh_token('me', 'secret')
+        self.assertTrue(portal.valid_token(token))
+        self.assertEqual([_[0][0] for _ in request.call_args_list], ['GET', 'POST'])
+        # Sign in cookies stay with the driver, not in the session shared by other users
+        self.assertEqual(len(transport._s.cookies), 0)
+
+    def test_wrong_password(self):
+        portal = self.portal()
+        with self.assertRaises(AlertMessage) as e:
+            self.driver(portal.url).refresh_token('me', 'wrong')
+        self.assertIn('incorrect', str(e.exception))
+
+    def test_mfa_and_trusted_device(self):
+        portal = self.portal(mfa='123456')
+        cookie_dir = tempfile.mkdtemp()
+        driver = self.driver(portal.url, cookie_dir)
+        with self.assertRaises(MFACodeNeeded) as e:
+            driver.refresh_token('me', 'secret')
+        driver.send_mfa(e.exception.args[0], '123456')
+        token, _ = driver.get_token()
+        self.assertTrue(portal.valid_token(token))
+        self.assertEqual(portal.requests[-1][1].get('trusted'), 'true')
+        driver.close()
+
+        # Cookies of the trusted device skip the MFA form on next sign in
+        token, _ = self.driver(portal.url, cookie_dir).refresh_token('me', 'secret')
+        self.assertTrue(portal.valid_token(token))
+
+    def test_wrong_mfa_code(self):
+        portal = self.portal(mfa='123456')
+        driver = self.driver(portal.url)
+        with self.assertRaises(MFACodeNeeded) as e:
+            driver.refresh_token('me', 'secret')
+        with self.assertRaises(AlertMessage):
+            driver.send_mfa(e.exception.args[0], '000000')
+
+    def test_error_status_is_unsupported(self):
+        portal = self.portal()
+        with self.assertRaises(UnsupportedPortal):
+            self.driver(portal.url.replace('/start/', '/missing/')).refresh_token('me', 'secret')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+"""Offline benchmark of awssso commands.
+
+Runs `awssso configure`, `awssso login` and `awssso login --all` in fresh
+processes against local stand-ins: a fake AWS SSO portal API, STS and
+federation endpoint (one HTTP server, selected with the portal_endpoint,
+sts_endpoint and federation_endpoint profile settings), a JSON file keyring, a stub sign in driver
+and stub prompts (see tools/fakes.py). Nothing leaves the host.
+
+Reports the median and 90th percentile of each scenario and the throughput
+of bulk logins, and fails when a median exceeds its budget, or its
+baseline by more than --tolerance, or when a scenario does not behave as
+expected (e.g. a repeated `login -c` calling the federation endpoint):
+
+    python tools/bench.py [--profiles 50] [--runs 5] [--save bench.json] [--baseline bench.json]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from base64 import b64encode
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler
+from time import perf_counter, sleep
+from urllib.parse import parse_qs, urlparse
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(TOOLS_DIR)
+sys.path.insert(0, TOOLS_DIR)
+
+from fakeportal import ThreadingServer  # noqa: E402
+
+# Budgets (ms) of the median of each scenario, loose enough for CI runners
+BUDGETS = {
+    'startup': 500,
+    'configure': 3000,
+    'login (cache hit)': 600,
+    'login (renew credentials)': 2000,
+    'login (refresh token)': 2000,
+    'login --all (cache hit)': 2000,
+    'login --all (renew credentials)': 8000,
+    'login --all -j (cache hit)': 2000,
+    'login -c (cache hit)': 800,
+    'login --all -c (renew credentials)': 8000
+}
+
+RUN = 'import fakes; fakes.install(); from awssso.cli import main; main()'
+
+SAML = '''<samlp:Response xmlns:samlp="urn:oasis:names:tc:SAML:2.0:protocol" ID="_r" Version="2.0">
+<saml2:Assertion xmlns:saml2="urn:oasis:names:tc:SAML:2.0:assertion" ID="_a" Version="2.0">
+<saml2:Subject><saml2:SubjectConfirmation Method="urn:oasis:names:tc:SAML:2.0:cm:bearer">
+<saml2:SubjectConfirmationData NotOnOrAfter="{expires}" Recipient="https://signin.aws.amazon.com/saml"/>
+</saml2:SubjectConfirmation></saml2:Subject>
+<saml2:Conditions NotOnOrAfter="{expires}"/>
+<saml2:AttributeStatement>
+<saml2:Attribute Name="https://aws.amazon.com/SAML/Attributes/RoleSessionName"><saml2:AttributeValue>bench</saml2:AttributeValue></saml2:Attribute>
+<saml2:Attribute Name="https://aws.amazon.com/SAML/Attributes/Role"><saml2:AttributeValue>{role},{provider}</saml2:AttributeValue></saml2:Attribute>
+<saml2:Attribute Name="https://aws.amazon.com/SAML/Attributes/SessionDuration"><saml2:AttributeValue>3600</saml2:AttributeValue></saml2:Attribute>
+</saml2:AttributeStatement>
+</saml2:Assertion></samlp:Response>'''
+
+STS_RESPONSE = '''<AssumeRoleWithSAMLResponse xmlns="https://sts.amazonaws.com/doc/2011-06-15/">
+<AssumeRoleWithSAMLResult><Credentials>
+<AccessKeyId>ASIABENCH{n:011d}</AccessKeyId><SecretAccessKey>bench</SecretAccessKey><SessionToken>bench</SessionToken>
+<Expiration>{expires}</Expiration>
+</Credentials></AssumeRoleWithSAMLResult>
+<ResponseMetadata><RequestId>bench-{n}</RequestId></ResponseMetadata>
+</AssumeRoleWithSAMLResponse>'''
+
+
+def iso(delta):
+    return (datetime.now(timezone.utc) + delta).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class FakeAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def api(self):
+        return self.server.api
+
+    def _send(self, body, status=200, content_type='application/json'):
+        payload = (body if isinstance(body, str) else json.dumps(body)).encode()
+        sleep(self.api.latency)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/federation':
+            n = self.api.count('federation')
+            return self._send({'SigninToken': f'signin-{n}'})
+
+        self.api.count('portal')
+        if not self.headers.get('x-amz-sso_bearer_token'):
+            return self._send({'message': 'missing token'}, 401)
+
+        parts = url.path.strip('/').split('/')
+        if parts == ['token', 'whoAmI']:
+            return self._send({'userName': 'bench'})
+        if parts == ['instance', 'appinstances']:
+            return self._send({'result': [{
+                'id': f'ins-{i}',
+                'name': f'Account {i}',
+                'applicationName': 'AWS Account',
+                'searchMetadata': {'AccountId': f'{i:012d}'}
+            } for i in range(self.api.accounts)]})
+        if parts[:2] == ['instance', 'appinstance'] and parts[3:] == ['profiles']:
+            i = parts[2].split('-')[-1]
+            return self._send({'result': [{
+                'id': f'p-{i}',
+                'name': f'Role{i}',
+                'url': f'{self.api.url}/federation/instance/{parts[2]}/profile/p-{i}'
+            }]})
+        if parts[0] == 'federation':
+            i = int(parts[-1].split('-')[-1])
+            xml = SAML.format(
+                expires=iso(timedelta(minutes=5)),
+                role=f'arn:aws:iam::{i:012d}:role/Role{i}',
+                provider=f'arn:aws:iam::{i:012d}:saml-provider/AWSSSO'
+            )
+            return self._send({'encodedResponse': b64encode(xml.encode()).decode()})
+        self._send({'message': 'not found'}, 404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode())
+        if form.get('Action') != ['AssumeRoleWithSAML']:
+            return self._send('<ErrorResponse/>', 400, 'text/xml')
+        n = self.api.count('sts')
+        self._send(STS_RESPONSE.format(n=n, expires=iso(timedelta(hours=1))), content_type='text/xml')
+
+
+class FakeAPI():
+    """AWS SSO portal API and STS AssumeRoleWithSAML on one local HTTP server."""
+
+    def __init__(self, accounts, latency=0.0):
+        self.accounts = accounts
+        self.latency = latency
+        self.calls = {'portal': 0, 'sts': 0, 'federation': 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingServer(('127.0.0.1', 0), FakeAPIHandler)
+        self._server.api = self
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count(self, name):
+        with self._lock:
+            self.calls[name] += 1
+            return self.calls[name]
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def write_config(config_dir, api, profiles):
+    settings = [
+        'url = https://bench.awsapps.com/start/',
+        'username = bench',
+        'region = eu-west-1',
+        f'portal_endpoint = {api.url}',
+        f'sts_endpoint = {api.url}/',
+        f'federation_endpoint = {api.url}/federation',
+        'sts_region = eu-west-1'
+    ]
+    sections = ['[bench]', *settings[3:]]
+    for i in range(profiles):
+        sections += [f'[bench-{i}]', *settings, f'instance_id = ins-{i}', f'profile_id = p-{i}']
+    # Sign in tokens outlive a process only in a cache that expires entries
+    sections += ['[console]', *settings, 'instance_id = ins-0', 'profile_id = p-0', 'credentials_cache = shared']
+    with open(os.path.join(config_dir, 'config'), 'w') as f:
+        f.write('\n'.join(sections) + '\n')
+
+
+def environment(work_dir, signin_ms):
+    env = {k: v for k, v in os.environ.items() if not k.startswith(('AWSSSO_', 'AWS_'))}
+    env.update({
+        'PYTHONPATH': os.pathsep.join([TOOLS_DIR, ROOT_DIR]),
+        'PYTHON_KEYRING_BACKEND': 'fakekeyring.FileKeyring',
+        'BENCH_KEYRING': os.path.join(work_dir, 'keyring.json'),
+        'BENCH_PASSWORD': 'bench',
+        'BENCH_SIGNIN_MS': str(signin_ms),
+        'HOME': work_dir,
+        'AWSSSO_CONFIG_DIR': os.path.join(work_dir, 'awssso'),
+        'AWS_SHARED_CREDENTIALS_FILE': os.path.join(work_dir, 'credentials'),
+        'AWS_CONFIG_FILE': os.path.join(work_dir, 'aws-config'),
+        'AWS_EC2_METADATA_DISABLED': 'true'
+    })
+    return env
+
+
+def awssso(env, *args):
+    """Run awssso, return (elapsed seconds, stdout)."""
+    start = perf_counter()
+    p = subprocess.run([sys.executable, '-c', RUN, '--no-spinner', *args], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    elapsed = perf_counter() - start
+    if p.returncode:
+        raise SystemExit(f'awssso {" ".join(args)} failed:\n{p.stderr.decode()}')
+    return elapsed, p.stdout.decode()
+
+
+def check_console(api, calls, output):
+    """login -c prints a federation login URL, and reuses the sign in token of the warm up run."""
+    reasons = []
+    if not output.startswith(f'{api.url}/federation?Action=login&') or 'SigninToken=' not in output:
+        reasons.append('unexpected console URL')
+    if api.calls['federation'] != calls['federation']:
+        reasons.append(f'{api.calls["federation"] - calls["federation"]} federation calls on cache hit')
+    return reasons
+
+
+# Behaviour checked after the measured runs of a scenario, given the fake
+# API calls after the warm up run and its output
+CHECKS = {
+    'login -c (cache hit)': check_console
+}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profiles', type=int, default=50, help='profiles of the bulk login scenarios (default: 50)')
+    parser.add_argument('--runs', type=int, default=5, help='measured runs of each scenario, after a warm up run (default: 5)')
+    parser.add_argument('--workers', type=int, default=8, help='workers of the bulk login scenarios (default: 8)')
+    parser.add_argument('--latency-ms', type=float, default=0, help='latency added to each fake portal and STS response (default: 0)')
+    parser.add_argument('--signin-ms', type=int, default=0, help='time taken by the stub sign in (default: 0)')
+    parser.add_argument('--save', metavar='FILE', help='write the medians to FILE (JSON)')
+    parser.add_argument('--baseline', metavar='FILE', help='compare medians with those saved in FILE')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='slowdown from the baseline that fails, 0.5 is 50%% (default: 0.5)')
+    parser.add_argument('--no-budget', dest='budget', action='store_false', default=True, help='do not check the budgets')
+    args = parser.parse_args()
+
+    scenarios = [
+        ('startup', ['--help']),
+        ('configure', ['configure', '-p', 'bench', '-f', '--url', 'https://bench.awsapps.com/start/', '--username', 'bench']),
+        ('login (cache hit)', ['login', '-p', 'bench-0', '-j']),
+        ('login (renew credentials)', ['login', '-p', 'bench-0', '-j', '-r']),
+        ('login (refresh token)', ['login', '-p', 'bench-0', '-j', '-r', '-f']),
+        ('login --all (cache hit)', ['login', '--all', 'bench-*', '-w', str(args.workers)]),
+        ('login --all (renew credentials)', ['login', '--all', 'bench-*', '-r', '-w', str(args.workers)]),
+        ('login --all -j (cache hit)', ['login', '--all', 'bench-*', '-j', '-w', str(args.workers)]),
+        ('login -c (cache hit)', ['login', '-p', 'console', '-c']),
+        ('login --all -c (renew credentials)', ['login', '--all', 'bench-*', '-c', '-r', '-w', str(args.workers)])
+    ]
+    bulk = {_[0] for _ in scenarios if '--all' in _[1]}
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    work_dir = tempfile.mkdtemp(prefix='awssso-bench-')
+    results = {}
+    failed = False
+    try:
+        with FakeAPI(args.profiles, args.latency_ms / 1000) as api:
+            os.mkdir(os.path.join(work_dir, 'awssso'))
+            write_config(os.path.join(work_dir, 'awssso'), api, args.profiles)
+            env = environment(work_dir, args.signin_ms)
+
+            print(f'{"scenario":36}  {"median":>9}  {"p90":>9}  {"budget":>9}  {"baseline":>9}  status')
+            for name, cmd in scenarios:
+                _, output = awssso(env, *cmd)
+                calls = dict(api.calls)
+                runs = [awssso(env, *cmd)[0] * 1000 for _ in range(args.runs)]
+                median, p90 = percentile(runs, 0.5), percentile(runs, 0.9)
+                results[name] = round(median, 1)
+
+                reasons = CHECKS[name](api, calls, output) if name in CHECKS else []
+                if args.budget and median > BUDGETS[name]:
+                    reasons.append('over budget')
+                if name in baseline and median > baseline[name] * (1 + args.tolerance):
+                    reasons.append(f'{median / baseline[name]:.2f}x baseline')
+                failed = failed or bool(reasons)
+
+                base = f'{baseline[name]:7.1f}ms' if name in baseline else f'{"-":>9}'
+                line = f'{name:36}  {median:7.1f}ms  {p90:7.1f}ms  {BUDGETS[name]:7d}ms  {base}  {"FAIL " + ", ".join(reasons) if reasons else "ok"}'
+                if name in bulk:
+                    line += f'  ({args.profiles / median * 1000:.1f} profiles/s)'
+                print(line, flush=True)
+
+            print(f'fake API calls: {api.calls["portal"]} portal, {api.calls["sts"]} STS, {api.calls["federation"]} federation')
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
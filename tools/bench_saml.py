@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Micro-benchmark of the SAML assertion parser.
+
+Compares awssso.saml.parse_assertion with the former SAMLHelper parse (full
+DOM, then the first role and SessionDuration by XPath), on generated
+assertions the size of real world ones (signed, with an embedded certificate)
+carrying an increasing number of roles. parse_assertion also reads every
+role, RoleSessionName and NotOnOrAfter, and checks the document for a DTD:
+
+    python tools/bench_saml.py [--roles 1 10 100 1000] [--number 200]
+"""
+import argparse
+import os
+import sys
+import timeit
+import xml.etree.ElementTree as ET
+from base64 import b64decode, b64encode
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from awssso.saml import parse_assertion  # noqa: E402
+
+NS = {
+    'a': 'urn:oasis:names:tc:SAML:2.0:assertion'
+}
+
+XPATH = {
+    'roles': ".//a:Assertion/a:AttributeStatement/a:Attribute[@Name='https://aws.amazon.com/SAML/Attributes/Role']/a:AttributeValue",
+    'duration': ".//a:Assertion/a:AttributeStatement/a:Attribute[@Name='https://aws.amazon.com/SAML/Attributes/SessionDuration']/a:AttributeValue"
+}
+
+RESPONSE = '''<samlp:Response xmlns:samlp="urn:oasis:names:tc:SAML:2.0:protocol" ID="_r" Version="2.0" IssueInstant="2019-09-30T12:00:00Z">
+<saml2:Issuer xmlns:saml2="urn:oasis:names:tc:SAML:2.0:assertion">https://portal.sso.eu-west-1.amazonaws.com/saml/assertion/X</saml2:Issuer>
+<samlp:Status><samlp:StatusCode Value="urn:oasis:names:tc:SAML:2.0:status:Success"/></samlp:Status>
+<saml2:Assertion xmlns:saml2="urn:oasis:names:tc:SAML:2.0:assertion" ID="_a" Version="2.0" IssueInstant="2019-09-30T12:00:00Z">
+<saml2:Issuer>https://portal.sso.eu-west-1.amazonaws.com/saml/assertion/X</saml2:Issuer>
+<ds:Signature xmlns:ds="http://www.w3.org/2000/09/xmldsig#"><ds:SignedInfo>
+<ds:CanonicalizationMethod Algorithm="http://www.w3.org/2001/10/xml-exc-c14n#"/>
+<ds:SignatureMethod Algorithm="http://www.w3.org/2001/04/xmldsig-more#rsa-sha256"/>
+<ds:Reference URI="#_a"><ds:DigestValue>{digest}</ds:DigestValue></ds:Reference>
+</ds:SignedInfo><ds:SignatureValue>{signature}</ds:SignatureValue>
+<ds:KeyInfo><ds:X509Data><ds:X509Certificate>{certificate}</ds:X509Certificate></ds:X509Data></ds:KeyInfo></ds:Signature>
+<saml2:Subject><saml2:NameID Format="urn:oasis:names:tc:SAML:1.1:nameid-format:emailAddress">me@example.com</saml2:NameID>
+<saml2:SubjectConfirmation Method="urn:oasis:names:tc:SAML:2.0:cm:bearer">
+<saml2:SubjectConfirmationData NotOnOrAfter="2019-09-30T12:05:00Z" Recipient="https://signin.aws.amazon.com/saml"/>
+</saml2:SubjectConfirmation></saml2:Subject>
+<saml2:Conditions NotBefore="2019-09-30T11:55:00Z" NotOnOrAfter="2019-09-30T12:05:00.123Z">
+<saml2:AudienceRestriction><saml2:Audience>https://signin.aws.amazon.com/saml</saml2:Audience></saml2:AudienceRestriction>
+</saml2:Conditions>
+<saml2:AuthnStatement AuthnInstant="2019-09-30T12:00:00Z" SessionIndex="_s"><saml2:AuthnContext>
+<saml2:AuthnContextClassRef>urn:oasis:names:tc:SAML:2.0:ac:classes:PasswordProtectedTransport</saml2:AuthnContextClassRef>
+</saml2:AuthnContext></saml2:AuthnStatement>
+<saml2:AttributeStatement>
+<saml2:Attribute Name="https://aws.amazon.com/SAML/Attributes/RoleSessionName"><saml2:AttributeValue>me@example.com</saml2:AttributeValue></saml2:Attribute>
+<saml2:Attribute Name="https://aws.amazon.com/SAML/Attributes/Role">{roles}</saml2:Attribute>
+<saml2:Attribute Name="https://aws.amazon.com/SAML/Attributes/SessionDuration"><saml2:AttributeValue>3600</saml2:AttributeValue></saml2:Attribute>
+</saml2:AttributeStatement>
+</saml2:Assertion></samlp:Response>'''
+
+
+def assertion(roles):
+    values = ''.join(
+        f'<saml2:AttributeValue>arn:aws:iam::000000000000:role/Role{i},arn:aws:iam::000000000000:saml-provider/AWSSSO</saml2:AttributeValue>'
+        for i in range(roles)
+    )
+    xml = RESPONSE.format(
+        digest=b64encode(os.urandom(32)).decode(),
+        signature=b64encode(os.urandom(256)).decode(),
+        certificate=b64encode(os.urandom(1200)).decode(),
+        roles=values
+    )
+    return b64encode(xml.encode()).decode()
+
+
+def legacy(encoded_payload):
+    """The former SAMLHelper parse, as it was: whole DOM, then one XPath lookup per attribute."""
+    root = ET.fromstring(b64decode(encoded_payload))
+    role = tuple(root.find(XPATH['roles'], NS).text.split(','))
+    duration = int(root.find(XPATH['duration'], NS).text)
+    return role, duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--roles', type=int, nargs='+', default=[1, 10, 100, 1000])
+    parser.add_argument('--number', type=int, default=200, help='parses per measure (default: 200)')
+    args = parser.parse_args()
+
+    print(f'{"roles":>6}  {"size":>9}  {"former":>12}  {"parse":>12}  {"ratio":>7}')
+    for roles in args.roles:
+        payload = assertion(roles)
+        parsed = parse_assertion(payload)
+        assert parsed.roles[0] == legacy(payload)[0] and len(parsed.roles) == roles
+        assert parsed.not_on_or_after is not None
+
+        before = min(timeit.repeat(lambda: legacy(payload), number=args.number, repeat=5)) / args.number
+        after = min(timeit.repeat(lambda: parse_assertion(payload), number=args.number, repeat=5)) / args.number
+        print(f'{roles:>6}  {len(payload):>8}B  {before * 1e6:>10.1f}us  {after * 1e6:>10.1f}us  {before / after:>6.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Keyring backend of tools/bench.py, selected with PYTHON_KEYRING_BACKEND=fakekeyring.FileKeyring.
+
+Kept apart from tools/fakes.py: keyring imports this module while it is
+itself being imported.
+"""
+import json
+import os
+import threading
+
+from keyring.backend import KeyringBackend
+
+
+class FileKeyring(KeyringBackend):
+    """Keyring in a JSON file, shared by the processes of a benchmark run."""
+
+    priority = 1
+    _lock = threading.Lock()
+
+    @property
+    def path(self):
+        return os.environ['BENCH_KEYRING']
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def get_password(self, service, username):
+        with FileKeyring._lock:
+            return self._load().get(f'{service}|{username}')
+
+    def set_password(self, service, username, password):
+        with FileKeyring._lock:
+            entries = self._load()
+            entries[f'{service}|{username}'] = password
+            with open(f'{self.path}.tmp', 'w') as f:
+                json.dump(entries, f)
+            os.replace(f'{self.path}.tmp', self.path)
+
+    def delete_password(self, service, username):
+        with FileKeyring._lock:
+            entries = self._load()
+            entries.pop(f'{service}|{username}', None)
+            with open(f'{self.path}.tmp', 'w') as f:
+                json.dump(entries, f)
+            os.replace(f'{self.path}.tmp', self.path)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+"""Local stand-in for an AWS SSO user portal sign in page.
+
+Serves the username / password and MFA forms driven by the browserless
+engine (engine = http), so that it can be exercised offline:
+
+    python tools/fakeportal.py --port 8080 --username me --password secret --mfa 123456
+
+or from Python:
+
+    with FakePortal(mfa='123456') as portal:
+        SSOHTTPDriver(portal.url, 'me').refresh_token('me', 'secret')
+"""
+import argparse
+import html
+import secrets
+import threading
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from time import time
+from urllib.parse import parse_qs, urlparse
+
+LOGIN_PAGE = '''<html><body>
+{alert}
+<form id="login_form" method="post" action="/login">
+  <input type="hidden" name="csrf" value="{csrf}">
+  <input id="wdc_username" name="username" type="text">
+  <input id="wdc_password" name="password" type="password">
+  <button id="wdc_login_button" type="submit">Sign In</button>
+</form>
+</body></html>'''
+
+MFA_PAGE = '''<html><body>
+{alert}
+<form id="mfa_form" method="post" action="/mfa">
+  <input type="hidden" name="csrf" value="{csrf}">
+  <input id="wdc_mfacode" name="mfacode" type="text">
+  <input id="wdc_mfacheckbox" name="trusted" type="checkbox" value="true">
+  <button id="wdc_login_button" type="submit">Sign In</button>
+</form>
+</body></html>'''
+
+ALERT = '''<div id="alertFrame"><div class="a-alert-error"><div class="a-box-inner">
+  <h4>{error}</h4><div class="gwt-Label">{message}</div>
+</div></div></div>'''
+
+DASHBOARD_PAGE = '<html><body><portal-dashboard></portal-dashboard></body></html>'
+
+
+class FakePortalHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    @property
+    def portal(self):
+        return self.server.portal
+
+    def _cookies(self):
+        return SimpleCookie(self.headers.get('Cookie', ''))
+
+    def _send(self, body, status=200, cookies=None):
+        payload = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        for cookie in cookies or []:
+            self.send_header('Set-Cookie', cookie)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _form(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+
+    def _alert(self, error, message):
+        return ALERT.format(error=html.escape(error), message=html.escape(message))
+
+    def _token_cookie(self):
+        token, expiry = self.portal.new_token()
+        if self.portal.session_cookie:
+            return f'x-amz-sso_authn={token}; Path=/'
+        return f'x-amz-sso_authn={token}; Path=/; Max-Age={int(expiry - time())}'
+
+    def _signed_in(self):
+        return self._send(DASHBOARD_PAGE, cookies=[self._token_cookie()])
+
+    def do_GET(self):
+        if urlparse(self.path).path != '/start/':
+            return self._send('not found', 404)
+        cookie = self._cookies().get('x-amz-sso_authn')
+        if cookie and self.portal.valid_token(cookie.value):
+            return self._send(DASHBOARD_PAGE)
+        self._send(LOGIN_PAGE.format(alert='', csrf=self.portal.csrf))
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        form = self._form()
+        self.portal.requests.append((path, form))
+
+        if form.get('csrf') != self.portal.csrf:
+            return self._send(LOGIN_PAGE.format(alert=self._alert('Error', 'Invalid request'), csrf=self.portal.csrf))
+
+        if path == '/login':
+            if (form.get('username'), form.get('password')) != (self.portal.username, self.portal.password):
+                alert = self._alert('Authentication failed', 'Your username or password is incorrect.')
+                return self._send(LOGIN_PAGE.format(alert=alert, csrf=self.portal.csrf))
+            trusted = self._cookies().get('trusted-device')
+            if self.portal.mfa and not (trusted and trusted.value == self.portal.device):
+                return self._send(MFA_PAGE.format(alert='', csrf=self.portal.csrf))
+            return self._signed_in()
+
+        if path == '/mfa':
+            if form.get('mfacode') != self.portal.mfa:
+                alert = self._alert('Authentication failed', 'The MFA code is incorrect.')
+                return self._send(MFA_PAGE.format(alert=alert, csrf=self.portal.csrf))
+            if form.get('trusted'):
+                self.send_response(302)
+                self.send_header('Location', '/start/')
+                self.send_header('Set-Cookie', f'trusted-device={self.portal.device}; Path=/; Max-Age=86400')
+                self.send_header('Set-Cookie', self._token_cookie())
+                self.send_header('Content-Length', '0')
+                return self.end_headers()
+            return self._signed_in()
+
+        self._send('not found', 404)
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakePortal():
+    def __init__(self, username='me', password='secret', mfa=None, host='127.0.0.1', port=0, token_ttl=28800, session_cookie=False):
+        self.username = username
+        self.password = password
+        self.mfa = mfa
+        self.token_ttl = token_ttl
+        # Set the authn token as a session cookie, without expiry
+        self.session_cookie = session_cookie
+        self.csrf = secrets.token_hex(8)
+        self.device = secrets.token_hex(8)
+        self.tokens = {}
+        self.requests = []
+        self._server = ThreadingServer((host, port), FakePortalHandler)
+        self._server.portal = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/start/'
+
+    def new_token(self):
+        token = secrets.token_urlsafe(32)
+        self.tokens[token] = time() + self.token_ttl
+        return token, self.tokens[token]
+
+    def valid_token(self, token):
+        return self.tokens.get(token, 0) > time()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--username', default='me')
+    parser.add_argument('--password', default='secret')
+    parser.add_argument('--mfa', help='MFA code to expect (default: no MFA)')
+    args = parser.parse_args()
+
+    portal = FakePortal(args.username, args.password, args.mfa, args.host, args.port)
+    print(f'Fake portal listening on {portal.url}')
+    try:
+        portal._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""In-process stand-ins used by tools/bench.py to run awssso offline.
+
+    PYTHON_KEYRING_BACKEND=fakekeyring.FileKeyring  keyring kept in a JSON file (BENCH_KEYRING)
+    fakes.install()                                 stub sign in driver and prompts
+
+The stub driver signs in after BENCH_SIGNIN_MS milliseconds (default: 0)
+and prompts answer their default, or the first choice; the password
+prompt answers BENCH_PASSWORD.
+"""
+import os
+import sys
+import types
+from time import sleep, time
+
+
+class AlertMessage(Exception):
+    pass
+
+
+class MFACodeNeeded(Exception):
+    pass
+
+
+class StubDriver():
+    """Replaces SSODriver: signs in without a browser and hands out a token the fake portal accepts."""
+
+    def __init__(self, url, username, headless=True, cookie_dir=None, pool=None, timeout=30):
+        self._username = username
+
+    def refresh_token(self, username, password, restore=False):
+        sleep(int(os.environ.get('BENCH_SIGNIN_MS', '0')) / 1000)
+        return self.get_token()
+
+    def get_token(self, restore=False):
+        return f'token-{self._username}-{int(time())}', int(time()) + 8 * 3600
+
+    def send_mfa(self, mfa_form, mfacode, trusted_device=True):
+        pass
+
+    def close(self):
+        pass
+
+
+class Question():
+    def __init__(self, name, message='', default=None, choices=None, validate=None):
+        self.name = name
+        self.default = default
+        self.choices = choices
+
+
+def prompt(questions, answers=None, raise_keyboard_interrupt=False):
+    answers = answers if answers is not None else {}
+    for q in questions:
+        if q.choices:
+            choice = q.choices[0]
+            answers[q.name] = choice[1] if isinstance(choice, tuple) else choice
+        else:
+            answers[q.name] = q.default
+    return answers
+
+
+def install():
+    driver = types.ModuleType('awssso.ssodriver')
+    driver.SSODriver = StubDriver
+    driver.AlertMessage = AlertMessage
+    driver.MFACodeNeeded = MFACodeNeeded
+    sys.modules['awssso.ssodriver'] = driver
+
+    inquirer = types.ModuleType('inquirer')
+    inquirer.Text = inquirer.List = Question
+    inquirer.prompt = prompt
+    inquirer.password = lambda message='', default='', validate=None: os.environ.get('BENCH_PASSWORD', default)
+    inquirer.text = lambda message='', default='', validate=None: default
+    sys.modules['inquirer'] = inquirer
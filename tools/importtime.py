@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""Check the import time budget of awssso entry points.
+
+Runs `python -X importtime` on each entry point module and fails when its
+cumulative import time exceeds the budget, or when a module that is only
+needed to refresh credentials gets imported at startup.
+
+    python tools/importtime.py [--budget-ms 150] [--runs 5]
+"""
+import argparse
+import subprocess
+import sys
+
+ENTRY_POINTS = {
+    'awssso.cli': 150,
+    'awssso.client': 30,
+}
+
+# Only needed when a token or credentials have to be refreshed.
+FORBIDDEN = ['aiohttp', 'boto3', 'botocore', 'cryptography', 'halo', 'inquirer', 'pkg_resources', 'requests', 'selenium']
+
+
+def importtime(module):
+    code = f'import {module}, sys; print(",".join(sorted(sys.modules)))'
+    p = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True
+    )
+
+    cumulative = None
+    for line in p.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:'):
+            continue
+        fields = [_.strip() for _ in line[len('import time:'):].split('|')]
+        if fields[2] == module:
+            cumulative = int(fields[1])
+    return cumulative / 1000, p.stdout.strip().split(',')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget-ms', type=float, help='override the budget of every entry point')
+    parser.add_argument('--runs', type=int, default=5, help='keep the best of this many runs (default: 5)')
+    args = parser.parse_args()
+
+    failed = False
+    for module, budget in ENTRY_POINTS.items():
+        budget = args.budget_ms or budget
+        runs = [importtime(module) for _ in range(args.runs)]
+        elapsed = min(_[0] for _ in runs)
+        forbidden = sorted({_.split('.')[0] for _ in runs[0][1]} & set(FORBIDDEN))
+
+        status = 'ok'
+        if elapsed > budget or forbidden:
+            status = 'FAIL'
+            failed = True
+        print(f'{status:4} {module:16} {elapsed:8.1f} ms (budget: {budget} ms)')
+        if forbidden:
+            print(f'     {module} imports {", ".join(forbidden)}')
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())